@@ -0,0 +1,75 @@
+import copy
+import json
+from pathlib import Path
+
+# Diretório com as amostras originais (data/carts.json, data/users.json, data/products.json)
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+COLLECTIONS = ['carts', 'users', 'products']
+
+# Lê as amostras de cada coleção
+def load_samples(data_dir: Path = DATA_DIR) -> dict:
+    samples = {}
+    for name in COLLECTIONS:
+        with open(data_dir / f"{name}.json", encoding="utf-8") as f:
+            samples[name] = json.load(f)
+    return samples
+
+# Maior id inteiro de uma amostra (deslocamento entre cópias)
+def max_id(records: list) -> int:
+    return max((r['id'] for r in records if isinstance(r.get('id'), int)), default=0)
+
+# Desloca um id inteiro positivo; ids ausentes ou inválidos são mantidos como estão
+def shift_id(value, offset: int):
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value + offset
+    return value
+
+# Acrescenta o número da cópia a um texto não vazio (campos usados na deduplicação)
+def tag_text(value, copy_number: int, separator: str):
+    if isinstance(value, str) and value.strip() != '':
+        return f"{value}{separator}{copy_number}"
+    return value
+
+def scale_samples(samples: dict, factor: int) -> dict:
+    """
+    Gera as coleções com `factor` vezes o tamanho das amostras. Cada cópia
+    desloca os ids (e as referências userId/products.id dos carts) e marca
+    username e sku, de modo que as cópias não colidam entre si, mas todos os
+    problemas das amostras se repetem em cada cópia: datas em formatos
+    mistos, valores negativos, emails inválidos, campos vazios e duplicados.
+    """
+    offsets = {name: max_id(records) for name, records in samples.items()}
+    scaled = {name: [] for name in samples}
+    for copy_number in range(factor):
+        for user in samples['users']:
+            user = copy.deepcopy(user)
+            if copy_number:
+                user['id'] = shift_id(user.get('id'), copy_number * offsets['users'])
+                user['username'] = tag_text(user.get('username'), copy_number, '_')
+            scaled['users'].append(user)
+
+        for product in samples['products']:
+            product = copy.deepcopy(product)
+            if copy_number:
+                product['id'] = shift_id(product.get('id'), copy_number * offsets['products'])
+                product['sku'] = tag_text(product.get('sku'), copy_number, '-')
+            scaled['products'].append(product)
+
+        for cart in samples['carts']:
+            cart = copy.deepcopy(cart)
+            if copy_number:
+                cart['id'] = shift_id(cart.get('id'), copy_number * offsets['carts'])
+                cart['userId'] = shift_id(cart.get('userId'), copy_number * offsets['users'])
+                for item in cart.get('products') or []:
+                    if isinstance(item, dict):
+                        item['id'] = shift_id(item.get('id'), copy_number * offsets['products'])
+            scaled['carts'].append(cart)
+    return scaled
+
+# Insere as coleções geradas no banco do MongoDB (real ou mongomock), substituindo as existentes
+def populate_database(database, collections: dict, batch_size: int = 10000):
+    for name, records in collections.items():
+        database[name].drop()
+        for start in range(0, len(records), batch_size):
+            database[name].insert_many(records[start:start + batch_size])
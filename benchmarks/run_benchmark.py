@@ -0,0 +1,207 @@
+"""
+Benchmark do pipeline com dados sintéticos gerados a partir de data/*.json.
+
+Executa cada etapa (extração, cada função de transformação, cada função de
+carga e as views) sobre um MongoDB em memória (mongomock) e um PostgreSQL
+local, medindo tempo, linhas/segundo e pico de memória (tracemalloc).
+
+Uso (na raiz do projeto):
+    python -m benchmarks.run_benchmark --scales 1 10 100 1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+import mongomock                      # MongoDB em memória (apenas para o benchmark)
+import psycopg2
+
+from src import connections
+from src.extract.extract import extract_collection, invalidate_cache
+from src.transform import transform_carts, transform_products, transform_users
+from src.load import load
+from src.main import fetch_view
+from .generate_data import load_samples, scale_samples, populate_database
+
+MONGO_BENCH_DB = "bench"
+
+# Sequência de transformação de cada entidade (mesma ordem dos run_etl_*)
+PRODUCTS_STEPS = [
+    transform_products.drop_missing_values,
+    transform_products.drop_duplicates_values,
+    transform_products.drop_spaces,
+    transform_products.drop_inconsistent_values,
+]
+USERS_STEPS = [
+    transform_users.explode_address,
+    transform_users.drop_missing_values,
+    transform_users.drop_duplicates_values,
+    transform_users.clean_first_names,
+    transform_users.clean_last_names,
+    transform_users.clean_maiden_names,
+    transform_users.drop_inconsistent_values,
+    transform_users.parse_gender,
+    transform_users.clean_phone_numbers,
+    transform_users.clean_username,
+    transform_users.clean_user_fields,
+    transform_users.clean_user_email,
+    transform_users.clean_user_birthdate,
+]
+CARTS_STEPS = [
+    transform_carts.drop_missing_values,
+    transform_carts.drop_inconsistent_values,
+    transform_carts.transform_transaction_date,
+]
+
+# Executa uma etapa medindo tempo e pico de memória; registra o resultado e devolve a saída da etapa
+def measure(results: list, scale: int, stage: str, rows_in: int, func, *args, track_memory: bool = True, **kwargs):
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):    # Etapas de carga imprimem o progresso no stdout
+        output = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if track_memory else 0
+    if track_memory:
+        tracemalloc.stop()
+
+    rows_out = len(output) if hasattr(output, '__len__') else rows_in
+    results.append({
+        "scale": scale,
+        "stage": stage,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows_in / seconds, 1) if seconds > 0 else None,
+        "peak_memory_mb": round(peak / 1024 ** 2, 2) if track_memory else None,
+    })
+    return output
+
+# Aplica uma sequência de transformações, medindo cada função separadamente
+def run_steps(results: list, scale: int, module: str, steps: list, data, track_memory: bool):
+    for step in steps:
+        data = measure(results, scale, f"{module}.{step.__name__}", len(data), step, data, track_memory=track_memory)
+    return data
+
+# Cria o banco do benchmark (se necessário) e recria o schema public vazio
+def reset_bench_database(database: str):
+    params = dict(host=os.getenv("PG_HOST"), user=os.getenv("PG_USER"), password=os.getenv("PG_PASSWORD"))
+    conn = psycopg2.connect(dbname="postgres", **params)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (database,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{database}";')
+    conn.close()
+
+    conn = psycopg2.connect(dbname=database, **params)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    conn.close()
+
+# Executa todas as etapas para um fator de escala
+def run_scale(results: list, samples: dict, scale: int, bench_db: str | None, track_memory: bool):
+    collections = scale_samples(samples, scale)
+    client = mongomock.MongoClient()
+    populate_database(client[MONGO_BENCH_DB], collections)
+    del collections
+    connections._mongo_client = client                 # O pipeline passa a ler do MongoDB em memória
+    invalidate_cache()
+
+    # Extração
+    raw = {}
+    for name, fields in [('carts', transform_carts.CARTS_FIELDS),
+                         ('users', transform_users.USERS_FIELDS),
+                         ('products', transform_products.PRODUCTS_FIELDS)]:
+        count = client[MONGO_BENCH_DB][name].count_documents({})
+        raw[name] = measure(results, scale, f"extract_collection.{name}", count,
+                            extract_collection, name, fields, use_cache=False, track_memory=track_memory)
+
+    # Transformação
+    data_products = run_steps(results, scale, "transform_products", PRODUCTS_STEPS, raw['products'], track_memory)
+    data_users = run_steps(results, scale, "transform_users", USERS_STEPS, raw['users'], track_memory)
+    # Mesmas regras em uma única passada (caminho usado por run_etl_users; raw['users'] já tem o endereço expandido)
+    measure(results, scale, "transform_users.clean_users", len(raw['users']),
+            transform_users.clean_users, raw['users'], track_memory=track_memory)
+    data_carts = measure(results, scale, "transform_carts.remove_invalid_orders", len(raw['carts']),
+                         transform_carts.remove_invalid_orders, raw['carts'], raw['products'], track_memory=track_memory)
+    data_carts = run_steps(results, scale, "transform_carts", CARTS_STEPS, data_carts, track_memory)
+
+    # Carga e views
+    if bench_db is None:
+        return
+    reset_bench_database(bench_db)
+    conn = connections.get_pg_connection()
+    load.keys.start_load()                              # Banco recriado: cache de chaves conferido de novo
+    try:
+        cursor = conn.cursor()
+        measure(results, scale, "load.create_tables", 0, load.create_tables, cursor, track_memory=track_memory)
+        measure(results, scale, "load.load_dim_users", len(data_users), load.load_dim_users, data_users, cursor, track_memory=track_memory)
+        measure(results, scale, "load.load_dim_products", len(data_products), load.load_dim_products, data_products, cursor, track_memory=track_memory)
+        measure(results, scale, "load.load_dim_time", len(data_carts), load.load_dim_time, data_carts, cursor, track_memory=track_memory)
+        carts_keys = measure(results, scale, "load.resolve_keys", len(data_carts), load.resolve_keys, data_carts, cursor, track_memory=track_memory)
+        measure(results, scale, "load.load_fact_sales", len(carts_keys), load.load_fact_sales, carts_keys, cursor, track_memory=track_memory)
+        measure(results, scale, "load.create_views", 0, load.create_views, cursor, track_memory=track_memory)
+        conn.commit()
+        cursor.execute("SELECT count(*) FROM fact_sales;")
+        fact_rows = cursor.fetchone()[0]
+        for view_name in load.VIEWS:
+            measure(results, scale, f"views.{view_name}", fact_rows, fetch_view, view_name, cursor, track_memory=track_memory)
+        cursor.close()
+    finally:
+        connections.release_pg_connection(conn)
+
+# Imprime os resultados em formato de tabela
+def print_report(results: list):
+    header = f"{'escala':>6}  {'etapa':<50} {'linhas':>9} {'saída':>9} {'segundos':>9} {'linhas/s':>12} {'pico MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        rate = f"{r['rows_per_sec']:.0f}" if r['rows_per_sec'] is not None else "-"
+        peak = f"{r['peak_memory_mb']:.1f}" if r['peak_memory_mb'] is not None else "-"
+        print(f"{r['scale']:>5}x  {r['stage']:<50} {r['rows_in']:>9} {r['rows_out']:>9} {r['seconds']:>9.3f} {rate:>12} {peak:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com dados sintéticos")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100, 1000],
+                        help="Fatores de escala sobre data/*.json (padrão: 1 10 100 1000)")
+    parser.add_argument("--pg-db", default=os.getenv("PG_BENCH_DB", "etl_bench"),
+                        help="Banco do PostgreSQL usado nas etapas de carga (recriado a cada escala)")
+    parser.add_argument("--skip-load", action="store_true", help="Mede apenas extração e transformação")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Desativa o tracemalloc (tempos sem o custo do rastreamento de memória)")
+    parser.add_argument("--output", help="Arquivo JSON para gravar os resultados")
+    parser.add_argument("--verbose", action="store_true", help="Mantém os logs do pipeline")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    bench_db = None
+    if not args.skip_load:
+        if args.pg_db == os.getenv("PG_DB"):
+            parser.error("--pg-db não pode ser o banco do pipeline (PG_DB): o schema é recriado a cada escala")
+        bench_db = args.pg_db
+        os.environ["PG_DB"] = bench_db                 # O pool de conexões é criado já apontando para o banco do benchmark
+    os.environ["MONGO_DB"] = MONGO_BENCH_DB
+
+    samples = load_samples()
+    results = []
+    try:
+        for scale in args.scales:
+            run_scale(results, samples, scale, bench_db, not args.no_memory)
+    finally:
+        connections.close_connections()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark dos validadores de nomes e emails (src/transform/validators.py).
+
+Compara, sobre os valores de data/users.json repetidos até --rows registros,
+a validação anterior (`Series.str.match` com o padrão em texto) e
+`validators.matches`, com colunas object e string[pyarrow]. Cada resultado
+é conferido contra o re do Python registro a registro, aplicado aos
+mesmos valores (após a preparação da coluna) que os métodos validam.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.validators_benchmark --rows 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.transform import validators
+from .generate_data import load_samples
+
+# Coluna -> (padrão, preparação aplicada antes da validação, como nas regras de transform_users)
+CHECKS = {
+    'firstName': (validators.NAME_PATTERN, None),
+    'lastName': (validators.NAME_PATTERN, None),
+    'maidenName': (validators.NAME_PATTERN, None),
+    'email': (validators.EMAIL_PATTERN, lambda s: s.str.strip().str.lower()),
+}
+
+# Mede o menor tempo entre `repeat` execuções
+def best_time(func, repeat: int):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos validadores de nomes e emails")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Registros por coluna (padrão: 1000000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Execuções por medição (vale a menor)")
+    args = parser.parse_args()
+
+    users = load_samples()['users']
+    header = f"{'coluna':<12} {'dtype':<16} {'método':<20} {'segundos':>9} {'linhas/s':>12} {'divergências':>13}"
+    print(header)
+    print("-" * len(header))
+    for column, (pattern, prepare) in CHECKS.items():
+        values = np.resize(np.array([u.get(column) for u in users], dtype=object), args.rows)
+        for dtype in [object, "string[pyarrow]"]:
+            series = pd.Series(values, dtype=dtype)
+            if prepare is not None:
+                series = prepare(series)
+            # re do Python, registro a registro, sobre os mesmos valores (já preparados) que os métodos validam
+            reference = validators.python_matches(series.to_numpy(dtype=object), pattern)
+            methods = {
+                "str.match": lambda: series.str.match(pattern.pattern, na=False).to_numpy(dtype=bool),
+                "validators.matches": lambda: validators.matches(series, pattern),
+            }
+            for method, func in methods.items():
+                seconds, result = best_time(func, args.repeat)
+                diffs = int(np.count_nonzero(result != reference))
+                print(f"{column:<12} {str(series.dtype):<16} {method:<20} {seconds:>9.3f} "
+                      f"{args.rows / seconds:>12.0f} {diffs:>13}")
+
+if __name__ == "__main__":
+    main()
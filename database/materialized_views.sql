@@ -0,0 +1,87 @@
+-- Versão materializada das views analíticas (PG_VIEWS_MODE=materialized)
+-- Cada resultado é guardado em uma view materializada mv_*; as views vw_* mantêm o
+-- nome e a ordenação originais lendo o resultado já agregado.
+-- O índice único de cada mv_* permite REFRESH MATERIALIZED VIEW CONCURRENTLY após cada carga.
+
+-- Receita total por localização
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_revenue_by_location AS
+	SELECT us.city, us.state, us.country,
+	       SUM(sa.unit_price * sa.quantity) AS revenue_total
+	FROM fact_sales AS sa
+	LEFT JOIN dim_users AS us ON us.user_id = sa.user_id
+	GROUP BY us.city, us.state, us.country;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_revenue_by_location
+	ON mv_revenue_by_location (city, state, country) NULLS NOT DISTINCT;
+CREATE OR REPLACE VIEW vw_revenue_by_location AS
+	SELECT * FROM mv_revenue_by_location ORDER BY revenue_total DESC;
+
+-- Produtos mais vendidos por receita
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_selling_product AS
+	SELECT pr.product_id, pr.title, pr.brand,
+	       SUM(sa.unit_price * sa.quantity) AS revenue
+	FROM fact_sales AS sa
+	LEFT JOIN dim_products AS pr ON sa.product_id = pr.product_id
+	GROUP BY pr.product_id, pr.title, pr.brand;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_top_selling_product
+	ON mv_top_selling_product (product_id) NULLS NOT DISTINCT;
+CREATE OR REPLACE VIEW vw_top_selling_product AS
+	SELECT * FROM mv_top_selling_product ORDER BY revenue DESC;
+
+-- Receita por marca em cada estado
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_brand_selling_state AS
+	SELECT pr.brand, us.state,
+	       SUM(sa.unit_price * sa.quantity) AS revenue
+	FROM fact_sales AS sa
+	LEFT JOIN dim_products AS pr ON sa.product_id = pr.product_id
+	LEFT JOIN dim_users AS us ON sa.user_id = us.user_id
+	GROUP BY us.state, pr.brand;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_top_brand_selling_state
+	ON mv_top_brand_selling_state (brand, state) NULLS NOT DISTINCT;
+CREATE OR REPLACE VIEW vw_top_brand_selling_state AS
+	SELECT * FROM mv_top_brand_selling_state ORDER BY revenue DESC;
+
+-- Vendas e receita por avaliação de produto
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_rating_sales AS
+	SELECT pr.product_id, pr.title, pr.brand, pr.rating,
+	       SUM(sa.quantity) AS total_units_sold,
+	       SUM(sa.unit_price * sa.quantity) AS revenue_total
+	FROM fact_sales AS sa
+	LEFT JOIN dim_products AS pr ON sa.product_id = pr.product_id
+	GROUP BY pr.product_id, pr.title, pr.brand, pr.rating;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_rating_sales
+	ON mv_rating_sales (product_id) NULLS NOT DISTINCT;
+CREATE OR REPLACE VIEW vw_rating_sales AS
+	SELECT * FROM mv_rating_sales ORDER BY total_units_sold DESC;
+
+-- Receita por mês (nomes dos meses)
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_selling_months AS
+	SELECT
+		CASE ti.month
+	        WHEN 1 THEN 'Janeiro'
+	        WHEN 2 THEN 'Fevereiro'
+	        WHEN 3 THEN 'Março'
+	        WHEN 4 THEN 'Abril'
+	        WHEN 5 THEN 'Maio'
+	        WHEN 6 THEN 'Junho'
+	        WHEN 7 THEN 'Julho'
+	        WHEN 8 THEN 'Agosto'
+	        WHEN 9 THEN 'Setembro'
+	        WHEN 10 THEN 'Outubro'
+	        WHEN 11 THEN 'Novembro'
+	        WHEN 12 THEN 'Dezembro'
+	    END AS month,
+		SUM(sa.quantity * sa.unit_price) AS revenue
+	FROM fact_sales AS sa
+	LEFT JOIN dim_time AS ti ON sa.time_id = ti.time_id
+	GROUP BY ti.month;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_top_selling_months
+	ON mv_top_selling_months (month) NULLS NOT DISTINCT;
+CREATE OR REPLACE VIEW vw_top_selling_months AS
+	SELECT * FROM mv_top_selling_months ORDER BY revenue DESC;
+
+-- Atualização após cada carga (sem bloquear leituras):
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mv_revenue_by_location;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mv_top_selling_product;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mv_top_brand_selling_state;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mv_rating_sales;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mv_top_selling_months;
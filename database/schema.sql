@@ -7,7 +7,8 @@ CREATE TABLE IF NOT EXISTS dim_users (
     gender VARCHAR(20),                -- Gênero do usuário (até 20 caracteres; poderia ser ENUM para padronização)
     city VARCHAR(20),                  -- Cidade do usuário
     state VARCHAR(20),                 -- Estado do usuário
-    country VARCHAR(20)                -- País do usuário
+    country VARCHAR(20),               -- País do usuário
+    row_hash BIGINT                    -- Hash dos atributos da linha (detecção de mudanças, PG_DIM_CHANGE_MODE)
 );
 
 -- Tabela de produtos (dimensão de produtos)
@@ -16,9 +17,27 @@ CREATE TABLE IF NOT EXISTS dim_products (
     title VARCHAR(50),                 -- Nome/título do produto
     price NUMERIC(10,2),               -- Preço do produto com precisão decimal (até 99999999.99)
     rating FLOAT,                      -- Avaliação do produto (permitindo casas decimais)
-    brand VARCHAR(20)                  -- Marca do produto
+    brand VARCHAR(20),                 -- Marca do produto
+    row_hash BIGINT                    -- Hash dos atributos da linha (detecção de mudanças, PG_DIM_CHANGE_MODE)
 );
 
+-- Versões das dimensões (SCD tipo 2, criadas apenas com PG_DIM_CHANGE_MODE=scd2): mesmas colunas da dimensão
+-- e o intervalo de validade [valid_from, valid_to); a versão atual tem valid_to nulo. Versões de linhas gravadas
+-- antes do modo scd2 ficam com valid_from nulo
+CREATE TABLE IF NOT EXISTS dim_users_history (
+    LIKE dim_users,
+    valid_from TIMESTAMP,              -- Início da validade da versão
+    valid_to TIMESTAMP                 -- Fim da validade (nulo na versão atual)
+);
+CREATE INDEX IF NOT EXISTS ix_dim_users_history_user_id ON dim_users_history (user_id);
+
+CREATE TABLE IF NOT EXISTS dim_products_history (
+    LIKE dim_products,
+    valid_from TIMESTAMP,              -- Início da validade da versão
+    valid_to TIMESTAMP                 -- Fim da validade (nulo na versão atual)
+);
+CREATE INDEX IF NOT EXISTS ix_dim_products_history_product_id ON dim_products_history (product_id);
+
 -- Tabela de tempo (dimensão de tempo)
 CREATE TABLE IF NOT EXISTS dim_time (
     time_id SERIAL PRIMARY KEY,        -- Identificador único da linha de tempo
@@ -38,3 +57,42 @@ CREATE TABLE IF NOT EXISTS fact_sales (
     quantity INT,                       -- Quantidade vendida
     CONSTRAINT unique_sale UNIQUE (user_id, product_id, time_id)  -- Garante que não haja duplicidade de vendas do mesmo usuário, produto e data
 );
+
+-- Tabela de controle da extração incremental (marca d'água por coleção)
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+    collection VARCHAR(50) PRIMARY KEY,          -- Nome da coleção no MongoDB
+    last_object_id VARCHAR(24) NOT NULL,         -- Maior _id (ObjectId) já carregado com sucesso
+    updated_at TIMESTAMP NOT NULL DEFAULT now()  -- Momento da última atualização
+);
+
+-- Tabela de controle da carga em lotes (PG_LOAD_BATCH_SIZE > 0): um checkpoint por lote confirmado
+CREATE TABLE IF NOT EXISTS etl_load_checkpoints (
+    load_id VARCHAR(40) NOT NULL,                  -- Carga (hash das marcas d'água que ela grava)
+    step VARCHAR(50) NOT NULL,                     -- Etapa da carga (ex.: dim_users, fact_sales:3)
+    batch INT NOT NULL,                            -- Número do lote na etapa
+    batch_hash VARCHAR(40) NOT NULL,               -- Hash do conteúdo do lote
+    rows INT NOT NULL,                             -- Registros do lote
+    committed_at TIMESTAMP NOT NULL DEFAULT now(), -- Momento da confirmação do lote
+    PRIMARY KEY (load_id, step, batch)
+);
+
+-- Índices da fact_sales para as views analíticas: cada chave estrangeira com as métricas incluídas,
+-- permitindo index-only scan nas agregações por produto, usuário e data
+CREATE INDEX IF NOT EXISTS ix_fact_sales_product_id ON fact_sales (product_id) INCLUDE (unit_price, quantity);
+CREATE INDEX IF NOT EXISTS ix_fact_sales_user_id ON fact_sales (user_id) INCLUDE (unit_price, quantity);
+CREATE INDEX IF NOT EXISTS ix_fact_sales_time_id ON fact_sales (time_id) INCLUDE (unit_price, quantity);
+
+-- Alternativa particionada da fact_sales (PG_FACT_PARTITION_SIZE > 0), por faixas de time_id.
+-- A chave primária inclui a coluna de partição; as partições fact_sales_pNNNN são criadas pelo loader.
+-- CREATE TABLE IF NOT EXISTS fact_sales (
+--     sale_id SERIAL,
+--     user_id INT REFERENCES dim_users(user_id),
+--     product_id INT REFERENCES dim_products(product_id),
+--     time_id INT REFERENCES dim_time(time_id),
+--     unit_price NUMERIC(10,2),
+--     quantity INT,
+--     PRIMARY KEY (sale_id, time_id),
+--     CONSTRAINT unique_sale UNIQUE (user_id, product_id, time_id)
+-- ) PARTITION BY RANGE (time_id);
+-- CREATE TABLE IF NOT EXISTS fact_sales_default PARTITION OF fact_sales DEFAULT;
+-- CREATE TABLE IF NOT EXISTS fact_sales_p0000 PARTITION OF fact_sales FOR VALUES FROM (0) TO (1000);
@@ -0,0 +1,114 @@
+import logging
+import os                             # Para acessar variáveis de ambiente
+import threading                      # Protege a criação dos pools quando usados por várias threads
+from contextlib import contextmanager
+from dotenv import load_dotenv        # Para carregar variáveis de ambiente de um arquivo .env
+from pymongo import MongoClient       # Cliente do MongoDB (já mantém um pool interno de conexões)
+from psycopg2 import pool, OperationalError, InterfaceError  # Pool de conexões do PostgreSQL
+
+# Carrega as variáveis do arquivo .env para uso no código
+load_dotenv()
+
+# Configuração de logging para acompanhar execução e erros
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Conexões compartilhadas durante toda a execução do pipeline
+_mongo_client = None
+_pg_pool = None
+_lock = threading.Lock()
+
+# Retorna o cliente do MongoDB compartilhado, criando-o (com health check) na primeira chamada
+def get_mongo_client() -> MongoClient:
+    global _mongo_client
+    with _lock:
+        if _mongo_client is None:
+            try:
+                # Recupera credenciais e informações de conexão do MongoDB do ambiente
+                username = os.getenv("MONGO_USER")
+                password = os.getenv("MONGO_PASSWORD")
+                host = os.getenv("MONGO_HOST")
+                port = os.getenv("MONGO_PORT")
+                database = os.getenv("MONGO_DB")
+
+                # Cria URI de conexão com autenticação; o tamanho do pool é configurável
+                uri = f"mongodb://{username}:{password}@{host}:{port}/{database}?authSource=admin"
+                client = MongoClient(uri, maxPoolSize=int(os.getenv("MONGO_POOL_SIZE", "10")))
+                client.admin.command('ping')   # Health check: falha cedo se o servidor não responder
+                _mongo_client = client
+                logging.info("Conexão com MongoDB estabelecida")
+            except Exception as e:
+                logging.error(f"Falha ao conectar no MongoDB: {e}")
+                raise
+        return _mongo_client
+
+# Retorna o pool de conexões do PostgreSQL, criando-o na primeira chamada
+def get_pg_pool() -> pool.ThreadedConnectionPool:
+    global _pg_pool
+    with _lock:
+        if _pg_pool is None:
+            try:
+                _pg_pool = pool.ThreadedConnectionPool(
+                    int(os.getenv("PG_POOL_MIN", "1")),
+                    int(os.getenv("PG_POOL_MAX", "5")),
+                    host=os.getenv("PG_HOST"),
+                    database=os.getenv("PG_DB"),
+                    user=os.getenv("PG_USER"),
+                    password=os.getenv("PG_PASSWORD")
+                )
+                logging.info("Pool de conexões com PostgreSQL criado")
+            except Exception as e:
+                logging.error(f"Falha ao conectar no PostgreSQL: {e}")
+                raise
+        return _pg_pool
+
+# Verifica se uma conexão do pool ainda está utilizável
+def is_pg_connection_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        conn.rollback()                        # Encerra a transação aberta pelo health check
+        return True
+    except (OperationalError, InterfaceError):
+        return False
+
+# Obtém uma conexão saudável do pool (conexões quebradas são descartadas)
+def get_pg_connection():
+    pg_pool = get_pg_pool()
+    conn = pg_pool.getconn()
+    if os.getenv("PG_HEALTH_CHECK", "true").lower() == "true" and not is_pg_connection_healthy(conn):
+        logging.warning("Conexão do pool com PostgreSQL inválida, abrindo uma nova")
+        pg_pool.putconn(conn, close=True)
+        conn = pg_pool.getconn()
+    return conn
+
+# Devolve a conexão ao pool (transações pendentes são revertidas pelo próprio pool)
+def release_pg_connection(conn):
+    if _pg_pool is not None:
+        _pg_pool.putconn(conn)
+
+# Context manager para usar uma conexão do pool e devolvê-la ao final
+@contextmanager
+def pg_connection():
+    conn = get_pg_connection()
+    try:
+        yield conn
+    finally:
+        release_pg_connection(conn)
+
+# Fecha o cliente do MongoDB e todas as conexões do pool do PostgreSQL (fim da execução)
+def close_connections():
+    global _mongo_client, _pg_pool
+    with _lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+            logging.info("Conexão com MongoDB fechada")
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+            logging.info("Conexões com PostgreSQL fechadas")
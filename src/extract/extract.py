@@ -1,8 +1,15 @@
 import logging
-from pymongo import MongoClient        # Biblioteca para conexão e operações no MongoDB
+from bson import ObjectId             # Tipo do campo _id, usado como marca d'água da extração incremental
+from bson import json_util            # Serialização determinística de consultas (chave do cache)
 from dotenv import load_dotenv        # Para carregar variáveis de ambiente de um arquivo .env
 import os                             # Para acessar variáveis de ambiente
+import hashlib                        # Nome estável dos arquivos do cache em Parquet
+import queue                          # Lotes lidos pelas partições concorrentes
+import threading
+from concurrent.futures import ThreadPoolExecutor  # Leitura concorrente das partições de _id
 import pandas as pd                   # Para manipulação de dados em DataFrames
+from .. import connections            # Conexões compartilhadas (MongoDB e PostgreSQL)
+from ..metrics import instrument      # Medição de tempo e memória por etapa
 
 # Carrega as variáveis do arquivo .env para uso no código
 load_dotenv()
@@ -13,42 +20,348 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Formato de log com timestamp, nível e mensagem
 )
 
-# Função para criar e retornar o cliente do MongoDB
+# Função que retorna o cliente compartilhado do MongoDB e o nome do banco
 def get_mongo_client():
+    # O cliente é criado uma única vez por execução e reutilizado (pool interno do pymongo)
+    return connections.get_mongo_client(), os.getenv("MONGO_DB")
+
+# Tamanho padrão dos lotes lidos do cursor do MongoDB
+DEFAULT_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "5000"))
+
+# Número de faixas de _id lidas em paralelo por coleção (1 = um único cursor)
+EXTRACT_PARTITIONS = int(os.getenv("MONGO_EXTRACT_PARTITIONS", "1"))
+# _ids amostrados por partição para calcular os limites das faixas
+PARTITION_SAMPLES_PER = 100
+
+# Cache de extrações da execução atual: chave (coleção, projeção, consulta) -> DataFrame ou arquivo Parquet.
+# Usado apenas nas leituras de products (use_cache=True), a única coleção lida por mais de uma etapa;
+# carts e users têm um único consumidor e são liberados logo após a transformação
+_extraction_cache = {}
+# Diretório opcional para descarregar o cache em Parquet e liberar memória
+CACHE_SPILL_DIR = os.getenv("EXTRACT_CACHE_SPILL_DIR")
+
+# Retorna o maior _id atual da coleção (limite superior da extração incremental)
+def get_max_object_id(collection_name: str) -> ObjectId | None:
+    client, database = get_mongo_client()
+    document = client[database][collection_name].find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    return document['_id'] if document else None
+
+# Monta o filtro de documentos com _id no intervalo (since, until]
+def build_watermark_query(since=None, until=None) -> dict | None:
+    condition = {}
+    if since is not None:
+        condition['$gt'] = ObjectId(str(since))
+    if until is not None:
+        condition['$lte'] = ObjectId(str(until))
+    return {'_id': condition} if condition else None
+
+# Converte uma lista de campos em projeção do MongoDB
+def build_projection(fields=None) -> dict | None:
+    if fields is None:
+        return None                    # Sem projeção: retorna todos os campos
+    if isinstance(fields, dict):
+        return fields                  # Projeção já no formato do MongoDB
+    projection = {field: 1 for field in fields}
+    projection.setdefault('_id', 0)    # _id só é retornado se for pedido explicitamente
+    return projection
+
+# Lê um cursor em lotes de batch_size documentos, devolvendo um DataFrame por lote
+def iter_cursor(cursor, batch_size: int):
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield pd.DataFrame(batch)  # Converte o lote e libera a lista de dicionários
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+# Combina a consulta do usuário (ex.: marca d'água) com a condição de uma partição
+def combine_queries(query: dict | None, condition: dict) -> dict:
+    return {'$and': [query, condition]} if query else condition
+
+# Apelido do $type do MongoDB para o tipo do _id; None se o tipo não puder ser particionado por faixas
+def id_type_alias(value) -> str | None:
+    if isinstance(value, ObjectId):
+        return 'objectId'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 'number'                # int, long e double são comparados entre si nas faixas
+    if isinstance(value, str):
+        return 'string'
+    return None
+
+def partition_queries(collection_name: str, query: dict | None, partitions: int) -> list[dict]:
+    """
+    Divide os documentos da consulta em até `partitions` faixas de _id,
+    com limites obtidos por amostragem ($sample de PARTITION_SAMPLES_PER
+    _id por partição, ordenados e cortados em quantis). As faixas são
+    contíguas e cobrem todos os _id do tipo amostrado; uma consulta extra
+    cobre _id de outros tipos (faixas no MongoDB só comparam valores do
+    mesmo tipo). Devolve [query] se a coleção não puder ser particionada.
+    """
+    client, database = get_mongo_client()
+    sample = client[database][collection_name].aggregate([
+        {'$match': query or {}},
+        {'$sample': {'size': partitions * PARTITION_SAMPLES_PER}},
+        {'$project': {'_id': 1}},
+    ])
+    ids = [document['_id'] for document in sample]
+    aliases = {id_type_alias(value) for value in ids}
+    if len(aliases) != 1 or None in aliases:
+        return [query or {}]           # Coleção vazia ou tipos de _id variados na amostra
+    ids = sorted(set(ids))
+    bounds = list(dict.fromkeys(ids[len(ids) * i // partitions] for i in range(1, partitions)))
+    if not bounds:
+        return [query or {}]
+    ranges = [{'$lt': bounds[0]}]
+    ranges += [{'$gte': low, '$lt': high} for low, high in zip(bounds, bounds[1:])]
+    ranges.append({'$gte': bounds[-1]})
+    conditions = [{'_id': condition} for condition in ranges]
+    conditions.append({'_id': {'$not': {'$type': aliases.pop()}}})
+    return [combine_queries(query, condition) for condition in conditions]
+
+# Lê as partições em paralelo pelo cliente compartilhado e devolve os lotes na ordem das partições.
+# Com prefetch, cada partição mantém no máximo esse número de lotes lidos à frente do consumo
+def iter_partitioned(collection_name: str, projection: dict | None, queries: list[dict],
+                     batch_size: int, prefetch: int = 0):
+    client, database = get_mongo_client()
+    collection = client[database][collection_name]
+    buffers = [queue.Queue(maxsize=prefetch) for _ in queries]
+    stop = threading.Event()
+
+    # Coloca um item no buffer da partição, desistindo se o consumidor tiver encerrado
+    def put(buffer: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_partition(buffer: queue.Queue, partition_query: dict):
+        try:
+            # Ordem por _id (índice) para que a concatenação das partições seja determinística
+            # (cada leitor usa sua própria cópia da projeção)
+            cursor = collection.find(partition_query, projection and dict(projection),
+                                     batch_size=batch_size, sort=[('_id', 1)])
+            for df in iter_cursor(cursor, batch_size):
+                if not put(buffer, df):
+                    return
+            put(buffer, None)          # Fim da partição
+        except Exception as e:
+            put(buffer, e)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        for buffer, partition_query in zip(buffers, queries):
+            executor.submit(read_partition, buffer, partition_query)
+        try:
+            for buffer in buffers:
+                while (item := buffer.get()) is not None:
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            stop.set()                 # Libera leitores bloqueados se o consumo for interrompido
+
+# Função geradora que lê uma coleção em lotes, devolvendo um DataFrame por lote.
+# Com partitions > 1 (padrão MONGO_EXTRACT_PARTITIONS) a coleção é lida em faixas de _id concorrentes,
+# e os lotes são devolvidos na ordem das faixas
+def iter_collection(collection_name: str, fields=None, query: dict | None = None,
+                    batch_size: int | None = None, partitions: int | None = None, prefetch: int = 0):
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    partitions = partitions or EXTRACT_PARTITIONS
+    projection = build_projection(fields)
+    client, database = get_mongo_client()  # Obtém cliente e nome do banco
     try:
-        # Recupera credenciais e informações de conexão do MongoDB do ambiente
-        username = os.getenv("MONGO_USER")
-        password = os.getenv("MONGO_PASSWORD")
-        host = os.getenv("MONGO_HOST")
-        port = os.getenv("MONGO_PORT")
-        database = os.getenv("MONGO_DB")
-
-        # Cria URI de conexão com autenticação
-        uri = f"mongodb://{username}:{password}@{host}:{port}/{database}?authSource=admin"
-        client = MongoClient(uri)
-        logging.info("Conexão com MongoDB estabelecida")  # Log de sucesso
-        return client, database
+        if partitions > 1:
+            queries = partition_queries(collection_name, query, partitions)
+            if len(queries) > 1:
+                logging.info(f"Lendo coleção '{collection_name}' em {len(queries)} partições de _id")
+                yield from iter_partitioned(collection_name, projection, queries, batch_size, prefetch)
+                return
+        collection = client[database][collection_name]
+        # Projeção aplicada no servidor e cursor lido em lotes de batch_size documentos
+        cursor = collection.find(query or {}, projection, batch_size=batch_size)
+        yield from iter_cursor(cursor, batch_size)
     except Exception as e:
-        logging.error(f"Falha ao conectar no MongoDB: {e}")  # Log de erro em caso de falha
-        raise  # Propaga o erro para o chamador tratar
+        logging.error(f"Erro ao ler coleção '{collection_name}': {e}")  # Log de erro caso algo falhe
+        raise
+
+# Monta a chave do cache a partir da coleção, projeção e consulta
+def cache_key(collection_name: str, fields=None, query: dict | None = None) -> tuple:
+    return (collection_name,
+            json_util.dumps(build_projection(fields), sort_keys=True),
+            json_util.dumps(query, sort_keys=True))
+
+# Grava um DataFrame do cache em Parquet; retorna o caminho ou None se não for possível
+def spill_to_parquet(key: tuple, df: pd.DataFrame) -> str | None:
+    os.makedirs(CACHE_SPILL_DIR, exist_ok=True)
+    path = os.path.join(CACHE_SPILL_DIR, f"{key[0]}_{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}.parquet")
+    try:
+        data = df.copy(deep=False)
+        if '_id' in data.columns:
+            data['_id'] = data['_id'].astype(str)  # ObjectId não tem tipo equivalente no Parquet
+        data.to_parquet(path, index=False)
+        return path
+    except Exception as e:
+        logging.warning(f"Não foi possível descarregar '{key[0]}' em Parquet, mantido em memória: {e}")
+        return None
+
+# Lê do Parquet um DataFrame descarregado pelo cache
+def read_spilled(path: str) -> pd.DataFrame:
+    df = pd.read_parquet(path)
+    if '_id' in df.columns:
+        df['_id'] = df['_id'].map(ObjectId)
+    return df
+
+# Remove do cache as extrações de uma coleção (ou todas, se collection_name for None)
+def invalidate_cache(collection_name: str | None = None):
+    for key in [k for k in _extraction_cache if collection_name is None or k[0] == collection_name]:
+        entry = _extraction_cache.pop(key)
+        if isinstance(entry, str) and os.path.exists(entry):
+            os.remove(entry)                   # Apaga o arquivo Parquet descarregado
+    logging.info(f"Cache de extração invalidado: {collection_name or 'todas as coleções'}")
+
+# Expressões de agregação com a mesma semântica do pandas: null, campo ausente e NaN contam como ausentes,
+# e comparações numéricas só valem para números (NaN não passa em nenhuma comparação)
+NAN = float('nan')
+
+def agg_is_missing(field: str) -> dict:
+    return {'$or': [{'$eq': [{'$ifNull': [field, None]}, None]}, {'$eq': [field, NAN]}]}   # NaN == NaN no MongoDB
+
+def agg_is_number(field: str) -> dict:
+    return {'$and': [{'$isNumber': field}, {'$ne': [field, NAN]}]}
+
+def agg_is_non_negative(field: str) -> dict:
+    return {'$and': [agg_is_number(field), {'$gte': [field, 0]}]}
+
+# Motivos de rejeição de carrinhos avaliados no MongoDB, na ordem das etapas do pandas
+CART_REJECTIONS = {
+    # remove_invalid_orders: algum item com quantidade abaixo do mínimo do produto
+    'minimum_quantity': {'$anyElementTrue': [{'$map': {
+        'input': '$_items', 'as': 'item',
+        'in': {'$anyElementTrue': [{'$map': {
+            'input': {'$filter': {'input': '$_minimums', 'as': 'product',
+                                  'cond': {'$eq': ['$$product.id', '$$item.id']}}},
+            'as': 'product',
+            'in': {'$and': [agg_is_number('$$item.quantity'),
+                            agg_is_number('$$product.minimumOrderQuantity'),
+                            {'$lt': ['$$item.quantity', '$$product.minimumOrderQuantity']}]},
+        }}]},
+    }}]},
+    # drop_missing_values
+    'missing_values': {'$or': [agg_is_missing(f) for f in ['$userId', '$products', '$total', '$discountedTotal']]},
+    # drop_inconsistent_values (valores ausentes ou negativos)
+    'inconsistent_values': {'$not': {'$and': [agg_is_non_negative(f) for f in
+                                              ['$total', '$totalProducts', '$totalQuantity']]}},
+}
+
+def build_carts_pipeline(fields, query: dict | None = None) -> list:
+    """
+    Pipeline de agregação que valida os carts no MongoDB e devolve os itens
+    já achatados. Cada carrinho válido vira um documento por item, com os
+    campos do carrinho (fields, que devem incluir os campos usados nas
+    validações), o _id do carrinho, item_index e product_id, price e
+    quantity. Carrinho válido sem itens gera um documento sem item_index.
+    Cada carrinho rejeitado vira um único documento {'rejected': motivo}
+    (ver CART_REJECTIONS), permitindo contar as rejeições como no pandas.
+    """
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 1
+    valid = {'$eq': ['$_rejected', None]}
+    cart_fields = [field for field in dict.fromkeys(f.split('.')[0] for f in fields) if field != 'products']
+    return [
+        *([{'$match': query}] if query else []),
+        {'$project': projection},
+        # Itens como lista (produto único fora de lista conta como um item, como no explode do pandas)
+        {'$addFields': {'_items': {'$cond': [{'$isArray': '$products'}, '$products',
+                                             {'$cond': [agg_is_missing('$products'), [], ['$products']]}]}}},
+        # Quantidade mínima de cada produto dos itens (apenas os campos usados)
+        {'$lookup': {'from': 'products', 'localField': '_items.id', 'foreignField': 'id',
+                     'pipeline': [{'$project': {'_id': 0, 'id': 1, 'minimumOrderQuantity': 1}}],
+                     'as': '_minimums'}},
+        {'$addFields': {'_rejected': {'$switch': {
+            'branches': [{'case': condition, 'then': reason} for reason, condition in CART_REJECTIONS.items()],
+            'default': None,
+        }}}},
+        # Rejeitados transferem apenas o motivo; válidos mantêm os campos e os itens
+        {'$project': {
+            'rejected': {'$cond': [valid, '$$REMOVE', '$_rejected']},
+            '_id': {'$cond': [valid, '$_id', '$$REMOVE']},
+            **{field: {'$cond': [valid, f'${field}', '$$REMOVE']} for field in cart_fields},
+            '_items': {'$cond': [valid, '$_items', '$$REMOVE']},
+        }},
+        {'$unwind': {'path': '$_items', 'preserveNullAndEmptyArrays': True, 'includeArrayIndex': 'item_index'}},
+        {'$addFields': {'product_id': '$_items.id', 'price': '$_items.price', 'quantity': '$_items.quantity'}},
+        {'$project': {'_items': 0}},
+    ]
+
+# Lê os itens de carts validados no MongoDB (build_carts_pipeline) em lotes:
+# devolve um DataFrame de itens por lote e a contagem de carrinhos rejeitados por motivo no lote
+def iter_cart_line_items(fields, query: dict | None = None, batch_size: int | None = None):
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    client, database = get_mongo_client()
+    try:
+        cursor = client[database]['carts'].aggregate(build_carts_pipeline(fields, query),
+                                                     batchSize=batch_size, allowDiskUse=True)
+        batch, rejected = [], {}
+        for document in cursor:
+            if 'rejected' in document:
+                rejected[document['rejected']] = rejected.get(document['rejected'], 0) + 1
+                continue
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch), rejected
+                batch, rejected = [], {}
+        if batch or rejected:
+            yield pd.DataFrame(batch), rejected
+    except Exception as e:
+        logging.error(f"Erro ao extrair itens de carts com agregação: {e}")
+        raise
+
+# Extrai todos os itens de carts validados no MongoDB; devolve o DataFrame de itens e as rejeições por motivo
+@instrument
+def extract_cart_line_items(fields, query: dict | None = None,
+                            batch_size: int | None = None) -> tuple:
+    logging.info("Iniciando extração de carts com validação no MongoDB (pushdown)")
+    chunks, rejected = [], {}
+    for chunk, chunk_rejected in iter_cart_line_items(fields, query, batch_size):
+        if not chunk.empty:
+            chunks.append(chunk)
+        for reason, count in chunk_rejected.items():
+            rejected[reason] = rejected.get(reason, 0) + count
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    logging.info(f"Extração de carts concluída: {len(df)} itens válidos, rejeitados por motivo: {rejected}")
+    return df, rejected
 
 # Função para extrair uma coleção do MongoDB como DataFrame do pandas
-def extract_collection(collection_name: str) -> pd.DataFrame:
+@instrument
+def extract_collection(collection_name: str, fields=None, query: dict | None = None,
+                       batch_size: int | None = None, use_cache: bool = False) -> pd.DataFrame:
+    key = cache_key(collection_name, fields, query)
+    if use_cache and key in _extraction_cache:
+        entry = _extraction_cache[key]
+        df = read_spilled(entry) if isinstance(entry, str) else entry
+        logging.info(f"Coleção '{collection_name}' obtida do cache de extração: {len(df)} registros")
+        return df.copy(deep=False)             # Cópia rasa: alterações de colunas não afetam o cache
+
     logging.info(f"Iniciando extração da coleção '{collection_name}'")  # Log inicial
-    client, database = get_mongo_client()  # Obtém cliente e nome do banco
     try:
-        db = client[database]                  # Seleciona o banco de dados
-        collection = db[collection_name]       # Seleciona a coleção desejada
-        data = list(collection.find())         # Recupera todos os documentos da coleção como lista de dicionários
-        if not data:
+        # Monta o DataFrame a partir dos lotes, sem manter todos os documentos em uma única lista
+        chunks = list(iter_collection(collection_name, fields, query, batch_size))
+        if not chunks:
             logging.warning(f"Coleção '{collection_name}' está vazia")  # Log caso não haja registros
-        df = pd.DataFrame(data)                # Converte lista de documentos em DataFrame do pandas
+            df = pd.DataFrame()
+        else:
+            df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
         logging.info(f"Extração da coleção '{collection_name}' concluída: {len(df)} registros")  # Log final
     except Exception as e:
         logging.error(f"Erro ao extrair coleção '{collection_name}': {e}")  # Log de erro caso algo falhe
         raise
-    finally:
-        client.close()                         # Fecha conexão com MongoDB para liberar recursos
-        logging.info("Conexão com MongoDB fechada")
-    
+
+    if use_cache:
+        path = spill_to_parquet(key, df) if CACHE_SPILL_DIR else None
+        _extraction_cache[key] = path or df
+        return df.copy(deep=False)
     return df  # Retorna o DataFrame com os dados da coleção
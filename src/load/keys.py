@@ -0,0 +1,196 @@
+import io
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# Configuração global de logs
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Arquivo opcional (.npz) onde o cache de chaves das dimensões é mantido entre execuções
+KEY_CACHE_FILE = os.getenv("PG_KEY_CACHE_FILE")
+
+# Dimensões com chaves em cache: tabela -> (chave natural, chave substituta)
+DIMENSION_KEYS = {
+    'dim_time': ('date', 'time_id'),
+    'dim_users': ('user_id', 'user_id'),
+    'dim_products': ('product_id', 'product_id'),
+}
+# Dimensões com detecção de mudanças: o hash dos atributos de cada linha (coluna row_hash) fica no cache
+HASHED_TABLES = {'dim_users', 'dim_products'}
+
+# Cache por dimensão: chaves naturais ordenadas, chaves substitutas (e hashes de linha) na mesma ordem
+# e a assinatura da tabela
+_cache = {}
+# Dimensões cuja assinatura já foi conferida com o banco na carga atual
+_verified = set()
+
+# Converte chaves naturais para o formato do cache (datas viram dias desde 1970-01-01)
+def to_keys(table: str, values) -> np.ndarray:
+    if table == 'dim_time':
+        dates = pd.to_datetime(pd.Series(values, dtype=object)).to_numpy(dtype='datetime64[D]')
+        return dates.astype('int64')           # NaT vira o menor int64, que nunca é uma chave válida
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+# Colunas lidas do banco (e do RETURNING das cargas) para o cache: chave natural, chave substituta e row_hash
+def key_columns(table: str) -> str:
+    natural, surrogate = DIMENSION_KEYS[table]
+    return f"{natural}, {surrogate}, row_hash" if table in HASHED_TABLES else f"{natural}, {surrogate}"
+
+# Contagem e maior chave substituta da tabela: identifica se a dimensão mudou fora desta execução
+# (nas dimensões com row_hash, a soma dos hashes identifica também atributos atualizados)
+def table_signature(cursor, table: str) -> list:
+    _, surrogate = DIMENSION_KEYS[table]
+    hash_sum = ", COALESCE(sum(row_hash), 0)" if table in HASHED_TABLES else ""
+    cursor.execute(f"SELECT current_database(), count(*), max({surrogate}){hash_sum} FROM {table};")
+    database, count, maximum, *hashes = cursor.fetchone()
+    return [database, int(count), None if maximum is None else int(maximum), *[int(value) for value in hashes]]
+
+# Monta uma entrada do cache a partir de linhas (chave natural, chave substituta[, row_hash])
+def build_entry(table: str, rows: list, signature: list) -> dict:
+    natural = to_keys(table, [row[0] for row in rows])
+    surrogate = np.array([row[1] for row in rows], dtype='int64')
+    order = np.argsort(natural, kind='stable')
+    entry = {'keys': natural[order], 'values': surrogate[order], 'signature': signature}
+    if table in HASHED_TABLES:
+        # Linhas gravadas antes da detecção de mudanças não têm hash (0: sempre tratadas como alteradas)
+        hashes = np.array([0 if row[2] is None else row[2] for row in rows], dtype='int64')
+        entry['hashes'] = hashes[order]
+    return entry
+
+# Lê todas as chaves da dimensão no banco (apenas quando o cache não existe ou está desatualizado)
+def fetch_entry(cursor, table: str, signature: list) -> dict:
+    cursor.execute(f"SELECT {key_columns(table)} FROM {table};")
+    entry = build_entry(table, cursor.fetchall(), signature)
+    logging.info(f"Cache de chaves de {table} carregado do banco: {len(entry['keys'])} chaves")
+    return entry
+
+# Lê a entrada da dimensão no arquivo de cache (None se não houver)
+def read_file_entry(table: str) -> dict | None:
+    if not KEY_CACHE_FILE or not os.path.exists(KEY_CACHE_FILE):
+        return None
+    try:
+        with np.load(KEY_CACHE_FILE) as data:
+            signatures = json.loads(str(data['signatures']))
+            if table not in signatures:
+                return None
+            entry = {'keys': data[f'{table}_keys'], 'values': data[f'{table}_values'], 'signature': signatures[table]}
+            if table in HASHED_TABLES:
+                if f'{table}_hashes' not in data.files:
+                    return None                # Arquivo gravado antes da detecção de mudanças
+                entry['hashes'] = data[f'{table}_hashes']
+            return entry
+    except Exception as e:
+        logging.warning(f"Arquivo de cache de chaves '{KEY_CACHE_FILE}' ignorado: {e}")
+        return None
+
+def get_keys(cursor, table: str) -> dict:
+    """
+    Retorna o cache de chaves da dimensão. Na primeira consulta de cada
+    carga, a assinatura da tabela (contagem e maior chave) é conferida com
+    a da memória ou do arquivo PG_KEY_CACHE_FILE; a tabela inteira só é
+    lida do banco se nenhum dos dois estiver atualizado.
+    """
+    if table in _verified:
+        return _cache[table]
+    signature = table_signature(cursor, table)
+    entry = _cache.get(table)
+    if entry is None or entry['signature'] != signature:
+        entry = read_file_entry(table)
+        if entry is None or entry['signature'] != signature:
+            entry = fetch_entry(cursor, table, signature)
+    _cache[table] = entry
+    _verified.add(table)
+    return entry
+
+# Posições das chaves consultadas no cache ordenado e quais delas existem no cache
+def locate(entry: dict, query: np.ndarray) -> tuple:
+    if len(entry['keys']) == 0:
+        return np.zeros(len(query), dtype='int64'), np.zeros(len(query), dtype=bool)
+    positions = np.minimum(np.searchsorted(entry['keys'], query), len(entry['keys']) - 1)
+    return positions, entry['keys'][positions] == query
+
+# Acrescenta ao cache as chaves inseridas (e atualiza o hash das linhas atualizadas) na carga atual,
+# a partir das linhas do RETURNING de key_columns. O cache deve ser obtido (get_keys) antes da
+# inserção; caso contrário é lido agora, já com as chaves novas
+def add_keys(cursor, table: str, rows: list):
+    if table not in _verified:
+        get_keys(cursor, table)
+        return
+    entry = _cache[table]
+    if not rows:
+        return
+    new = build_entry(table, rows, None)
+    positions, found = locate(entry, new['keys'])
+    inserted = ~found
+    natural = np.concatenate([entry['keys'], new['keys'][inserted]])
+    surrogate = np.concatenate([entry['values'], new['values'][inserted]])
+    order = np.argsort(natural, kind='stable')
+    database, count, maximum, *hash_sum = entry['signature']
+    maximum = max(int(new['values'].max()), maximum if maximum is not None else int(new['values'].max()))
+    updated = {'keys': natural[order], 'values': surrogate[order]}
+    if table in HASHED_TABLES:
+        hashes = entry['hashes'].copy()
+        # Soma exata (inteiros do Python), como o sum(row_hash) do PostgreSQL
+        hash_sum = [hash_sum[0] + new['hashes'].astype(object).sum() - hashes[positions[found]].astype(object).sum()]
+        hashes[positions[found]] = new['hashes'][found]
+        updated['hashes'] = np.concatenate([hashes, new['hashes'][inserted]])[order]
+    updated['signature'] = [database, count + int(inserted.sum()), maximum, *[int(value) for value in hash_sum]]
+    _cache[table] = updated
+
+def lookup(cursor, table: str, values) -> np.ndarray:
+    """
+    Resolve chaves naturais (ids ou datas) para as chaves substitutas da
+    dimensão com busca binária vetorizada no cache. Retorna um array float
+    com NaN para chaves inexistentes, como um merge à esquerda.
+    """
+    entry = get_keys(cursor, table)
+    positions, found = locate(entry, to_keys(table, values))
+    result = np.full(len(found), np.nan)
+    result[found] = entry['values'][positions[found]]
+    return result
+
+def changed(cursor, table: str, values, hashes: np.ndarray) -> np.ndarray:
+    """
+    Indica, para cada chave natural, se o registro é novo na dimensão ou
+    se o hash dos seus atributos difere do row_hash gravado (comparação
+    vetorizada com o cache, sem consultar as linhas no banco).
+    """
+    entry = get_keys(cursor, table)
+    positions, found = locate(entry, to_keys(table, values))
+    if not found.any():
+        return np.ones(len(found), dtype=bool)
+    return ~found | (entry['hashes'][positions] != hashes)
+
+# Inicia uma carga: as assinaturas voltam a ser conferidas na primeira consulta de cada dimensão
+def start_load():
+    _verified.clear()
+
+# Descarta o cache em memória (ex.: rollback de chaves acrescentadas por add_keys)
+def discard():
+    _cache.clear()
+    _verified.clear()
+
+# Grava o cache no arquivo PG_KEY_CACHE_FILE (após o commit da carga)
+def save():
+    if not KEY_CACHE_FILE or not _cache:
+        return
+    arrays = {}
+    for table, entry in _cache.items():
+        arrays[f'{table}_keys'], arrays[f'{table}_values'] = entry['keys'], entry['values']
+        if 'hashes' in entry:
+            arrays[f'{table}_hashes'] = entry['hashes']
+    arrays['signatures'] = np.array(json.dumps({table: entry['signature'] for table, entry in _cache.items()}))
+    directory = os.path.dirname(KEY_CACHE_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    temporary = f"{KEY_CACHE_FILE}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(temporary, KEY_CACHE_FILE)     # Substituição atômica: leitores nunca veem um arquivo incompleto
@@ -1,9 +1,19 @@
 import logging
-import psycopg2                       # Biblioteca para conexão e execução de SQL no PostgreSQL
 from dotenv import load_dotenv        # Para carregar variáveis de ambiente de um arquivo .env
 import os                             # Para acessar variáveis de ambiente
+import io                             # Buffer em memória para o COPY
+import hashlib                        # Identificação das cargas e dos lotes com checkpoint
+import json
+import uuid                           # Nomes únicos das tabelas de staging da carga paralela
+from concurrent.futures import ThreadPoolExecutor  # Carga paralela das partições da fact_sales
+import numpy as np
 import pandas as pd                   # Para manipulação de dados em DataFrames
 from psycopg2.extras import execute_values  # Função eficiente para inserção em lote no PostgreSQL
+from .. import connections            # Conexões compartilhadas (pool do PostgreSQL)
+from ..metrics import instrument      # Medição de tempo e memória por etapa
+from ..transform.line_items import flatten_line_items  # Itens dos carrinhos em colunas
+from .staging import read_staging     # Entidades transformadas gravadas em Parquet
+from . import keys                    # Cache das chaves das dimensões
 
 # Carrega variáveis do arquivo .env
 load_dotenv()
@@ -14,23 +24,67 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Formato: timestamp - nível - mensagem
 )
 
+# Backend de inserção em lote: 'copy' (COPY FROM STDIN + INSERT ... SELECT) ou 'values' (execute_values)
+LOAD_METHOD = os.getenv("PG_LOAD_METHOD", "copy").lower()
+
 # Função para conectar ao PostgreSQL
 def connect_db():
-    """Conecta ao PostgreSQL e retorna a conexão"""
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv("PG_HOST"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
-        logging.info("Conexão com PostgreSQL estabelecida")
-        return conn
-    except Exception as e:
-        logging.error(f"Falha ao conectar no PostgreSQL: {e}")
-        raise  # Propaga o erro para o chamador tratar
+    """Obtém uma conexão do pool compartilhado do PostgreSQL (devolver com release_db)"""
+    conn = connections.get_pg_connection()
+    logging.info("Conexão com PostgreSQL obtida do pool")
+    return conn
+
+# Função para devolver a conexão ao pool
+def release_db(conn):
+    """Devolve a conexão ao pool; transações pendentes são revertidas"""
+    connections.release_pg_connection(conn)
+
+# Tamanho dos lotes confirmados de forma independente na carga com checkpoints (0 = uma única transação)
+LOAD_BATCH_SIZE = int(os.getenv("PG_LOAD_BATCH_SIZE", "0"))
+
+# Detecção de mudanças nas dimensões users e products (hash dos atributos de cada linha em row_hash):
+#   'update': envia registros novos ou alterados e atualiza os alterados (SCD tipo 1)
+#   'scd2': como 'update', mantendo as versões anteriores em <dimensão>_history (SCD tipo 2)
+#   'insert': comportamento anterior, envia apenas registros novos; alterações são ignoradas (com aviso no log)
+DIM_CHANGE_MODE = os.getenv("PG_DIM_CHANGE_MODE", "update").lower()
+
+# Conexões usadas na carga paralela da fact_sales (1 = carga por uma única conexão)
+FACT_LOAD_WORKERS = int(os.getenv("PG_FACT_LOAD_WORKERS", "1"))
+# Abaixo deste número de registros a fact_sales é carregada por uma única conexão
+PARALLEL_MIN_ROWS = 50000
+
+# Particionamento da fact_sales por faixas de time_id (0 = tabela sem particionamento)
+# Só vale para uma fact_sales nova; uma tabela já existente não é convertida
+FACT_PARTITION_SIZE = int(os.getenv("PG_FACT_PARTITION_SIZE", "0"))
+
+# fact_sales particionada: a chave primária precisa incluir a coluna de partição
+FACT_SALES_PARTITIONED_SQL = """
+    CREATE TABLE IF NOT EXISTS fact_sales (
+        sale_id SERIAL,
+        user_id INT REFERENCES dim_users(user_id),
+        product_id INT REFERENCES dim_products(product_id),
+        time_id INT REFERENCES dim_time(time_id),
+        unit_price NUMERIC(10,2),
+        quantity INT,
+        PRIMARY KEY (sale_id, time_id),
+        CONSTRAINT unique_sale UNIQUE (user_id, product_id, time_id)
+    ) PARTITION BY RANGE (time_id);
+    CREATE TABLE IF NOT EXISTS fact_sales_default PARTITION OF fact_sales DEFAULT;
+"""
+
+# Versões das dimensões no modo scd2: mesmas colunas da dimensão e o intervalo de validade [valid_from, valid_to);
+# a versão atual tem valid_to nulo (os fatos continuam referenciando a chave da dimensão)
+HISTORY_SQL = """
+    CREATE TABLE IF NOT EXISTS {table}_history (
+        LIKE {table},
+        valid_from TIMESTAMP,
+        valid_to TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS ix_{table}_history_{key} ON {table}_history ({key});
+"""
 
 # Função para criar todas as tabelas do modelo estrela
+@instrument
 def create_tables(cursor):
     tables = {
         "dim_users": """
@@ -42,8 +96,10 @@ def create_tables(cursor):
                 gender VARCHAR(20),
                 city VARCHAR(20),
                 state VARCHAR(20),
-                country VARCHAR(20)
+                country VARCHAR(20),
+                row_hash BIGINT
             );
+            ALTER TABLE dim_users ADD COLUMN IF NOT EXISTS row_hash BIGINT;
         """,
         "dim_products": """
             CREATE TABLE IF NOT EXISTS dim_products (
@@ -51,8 +107,10 @@ def create_tables(cursor):
                 title VARCHAR(50),
                 price NUMERIC(10,2),
                 rating FLOAT,
-                brand VARCHAR(20)
+                brand VARCHAR(20),
+                row_hash BIGINT
             );
+            ALTER TABLE dim_products ADD COLUMN IF NOT EXISTS row_hash BIGINT;
         """,
         "dim_time": """
             CREATE TABLE IF NOT EXISTS dim_time (
@@ -63,7 +121,7 @@ def create_tables(cursor):
                 day INT
             );
         """,
-        "fact_sales": """
+        "fact_sales": FACT_SALES_PARTITIONED_SQL if FACT_PARTITION_SIZE > 0 else """
             CREATE TABLE IF NOT EXISTS fact_sales (
                 sale_id SERIAL PRIMARY KEY,
                 user_id INT REFERENCES dim_users(user_id),
@@ -73,8 +131,29 @@ def create_tables(cursor):
                 quantity INT,
                 CONSTRAINT unique_sale UNIQUE (user_id, product_id, time_id)
             );
+        """,
+        "etl_watermarks": """
+            CREATE TABLE IF NOT EXISTS etl_watermarks (
+                collection VARCHAR(50) PRIMARY KEY,
+                last_object_id VARCHAR(24) NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+        """,
+        "etl_load_checkpoints": """
+            CREATE TABLE IF NOT EXISTS etl_load_checkpoints (
+                load_id VARCHAR(40) NOT NULL,
+                step VARCHAR(50) NOT NULL,
+                batch INT NOT NULL,
+                batch_hash VARCHAR(40) NOT NULL,
+                rows INT NOT NULL,
+                committed_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (load_id, step, batch)
+            );
         """
     }
+    if DIM_CHANGE_MODE == 'scd2':
+        tables.update({f"{table}_history": HISTORY_SQL.format(table=table, key=keys.DIMENSION_KEYS[table][0])
+                       for table in keys.HASHED_TABLES})
 
     # Itera sobre todas as tabelas definidas e cria no banco
     for table_name, sql in tables.items():
@@ -85,11 +164,142 @@ def create_tables(cursor):
         except Exception as e:
             print(f"[ERROR] Falha ao criar tabela '{table_name}': {e}")
 
-# Função para criar todas as views definidas
-def create_views(cursor):
-    views = {
-        "vw_revenue_by_location": """
-            CREATE OR REPLACE VIEW vw_revenue_by_location AS 
+    create_indexes(cursor)
+
+# Índices usados pelas views analíticas: cada FK da fact_sales com as métricas incluídas (index-only scan)
+# (BRIN não se aplica: a ordem física da fact_sales segue a ordem dos carrinhos, não a do time_id)
+INDEXES = {
+    "ix_fact_sales_product_id": "CREATE INDEX IF NOT EXISTS ix_fact_sales_product_id ON fact_sales (product_id) INCLUDE (unit_price, quantity);",
+    "ix_fact_sales_user_id": "CREATE INDEX IF NOT EXISTS ix_fact_sales_user_id ON fact_sales (user_id) INCLUDE (unit_price, quantity);",
+    "ix_fact_sales_time_id": "CREATE INDEX IF NOT EXISTS ix_fact_sales_time_id ON fact_sales (time_id) INCLUDE (unit_price, quantity);"
+}
+
+# Função para criar os índices da fact_sales (idempotente)
+def create_indexes(cursor):
+    for index_name, sql in INDEXES.items():
+        try:
+            print(f"[INFO] Criando índice '{index_name}'...")
+            cursor.execute(sql)
+            print(f"[SUCCESS] Índice '{index_name}' criado ou já existia.")
+        except Exception as e:
+            print(f"[ERROR] Falha ao criar índice '{index_name}': {e}")
+
+# Verifica se a fact_sales foi criada particionada
+def is_fact_partitioned(cursor) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('fact_sales');")
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+# Cria as partições da fact_sales que cobrem os time_id até max_time_id (antes da inserção dos fatos)
+def ensure_fact_partitions(cursor, max_time_id):
+    if FACT_PARTITION_SIZE <= 0 or pd.isna(max_time_id) or not is_fact_partitioned(cursor):
+        return
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass('fact_sales');
+    """)
+    existing = {row[0] for row in cursor.fetchall()}
+    for number in range(int(max_time_id) // FACT_PARTITION_SIZE + 1):
+        partition = f"fact_sales_p{number:04d}"
+        if partition in existing:
+            continue
+        start, end = number * FACT_PARTITION_SIZE, (number + 1) * FACT_PARTITION_SIZE
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF fact_sales FOR VALUES FROM ({start}) TO ({end});")
+        logging.info(f"Partição {partition} criada (time_id de {start} a {end - 1})")
+
+# Retorna o último _id carregado com sucesso de cada coleção
+def get_watermarks(cursor) -> dict:
+    cursor.execute("SELECT to_regclass('etl_watermarks');")
+    if cursor.fetchone()[0] is None:
+        return {}                      # Primeira execução: tabela de controle ainda não existe
+    cursor.execute("SELECT collection, last_object_id FROM etl_watermarks;")
+    return dict(cursor.fetchall())
+
+# Grava as marcas d'água na mesma transação da carga
+def save_watermarks(cursor, watermarks: dict):
+    records = [(collection, str(object_id)) for collection, object_id in watermarks.items() if object_id is not None]
+    if not records:
+        return
+    execute_values(cursor, """
+        INSERT INTO etl_watermarks (collection, last_object_id)
+        VALUES %s
+        ON CONFLICT (collection) DO UPDATE
+            SET last_object_id = EXCLUDED.last_object_id, updated_at = now();
+    """, records)
+    logging.info(f"Marcas d'água atualizadas: {dict(records)}")
+
+# Identifica a carga pelas marcas d'água que ela grava (None sem checkpoints, PG_LOAD_BATCH_SIZE=0).
+# Uma nova execução sobre o mesmo intervalo de documentos reaproveita os lotes já confirmados
+def checkpoint_id(watermarks: dict | None) -> str | None:
+    if LOAD_BATCH_SIZE <= 0:
+        return None
+    marks = {collection: str(value) for collection, value in (watermarks or {}).items() if value is not None}
+    return hashlib.sha1(json.dumps(marks, sort_keys=True).encode()).hexdigest()
+
+# Hash do conteúdo de um lote: o checkpoint só vale para um lote com exatamente os mesmos registros
+def batch_hash(records: pd.DataFrame) -> str:
+    return hashlib.sha1(pd.util.hash_pandas_object(records, index=False).to_numpy().tobytes()).hexdigest()
+
+def insert_batches(cursor, step: str, records: pd.DataFrame, insert, load_id: str | None = None) -> list:
+    """
+    Insere os registros com insert(lote) e retorna os resultados de cada
+    inserção. Sem load_id, todos os registros vão em uma única chamada, na
+    transação em andamento. Com load_id, os registros são divididos em
+    lotes de PG_LOAD_BATCH_SIZE, e cada lote é confirmado (commit) junto
+    com seu checkpoint em etl_load_checkpoints; lotes com checkpoint da
+    mesma carga e mesmo conteúdo (batch_hash) já foram confirmados por uma
+    execução anterior e são ignorados.
+    """
+    if load_id is None:
+        return [insert(records)]
+    cursor.execute("SELECT batch, batch_hash FROM etl_load_checkpoints WHERE load_id = %s AND step = %s;",
+                   (load_id, step))
+    committed = dict(cursor.fetchall())
+    results, skipped = [], 0
+    for batch, start in enumerate(range(0, len(records), LOAD_BATCH_SIZE)):
+        chunk = records.iloc[start:start + LOAD_BATCH_SIZE]
+        digest = batch_hash(chunk)
+        if committed.get(batch) == digest:
+            skipped += 1
+            continue
+        results.append(insert(chunk))
+        cursor.execute("""
+            INSERT INTO etl_load_checkpoints (load_id, step, batch, batch_hash, rows)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (load_id, step, batch) DO UPDATE
+                SET batch_hash = EXCLUDED.batch_hash, rows = EXCLUDED.rows, committed_at = now();
+        """, (load_id, step, batch, digest, len(chunk)))
+        cursor.connection.commit()                     # Lote e checkpoint confirmados juntos
+    if skipped > 0:
+        logging.info(f"{skipped} lotes de {step} já confirmados em execução anterior foram ignorados")
+    return results
+
+# Início da carga no relógio do banco (início da transação), usado em clear_checkpoints
+def load_started_at(cursor):
+    cursor.execute("SELECT now();")
+    return cursor.fetchone()[0]
+
+# Remove, na transação que grava as marcas d'água, os checkpoints da carga concluída e os de cargas
+# interrompidas anteriores a ela: com as marcas d'água avançadas, nenhuma execução volta a usá-los
+# (uma carga reexecutada após a chegada de novos documentos tem outro load_id)
+def clear_checkpoints(cursor, load_id: str | None, started_at):
+    cursor.execute("DELETE FROM etl_load_checkpoints WHERE load_id = %s OR committed_at < %s;",
+                   (load_id, started_at))
+    if cursor.rowcount > 0:
+        logging.info(f"{cursor.rowcount} checkpoints de carga removidos")
+
+# Confere os planos das views analíticas após cada carga (EXPLAIN)
+EXPLAIN_VIEWS = os.getenv("PG_EXPLAIN_VIEWS", "false").lower() == "true"
+
+# Modo das views analíticas: 'view' (views comuns) ou 'materialized' (resultados materializados)
+VIEWS_MODE = os.getenv("PG_VIEWS_MODE", "view").lower()
+
+# Consultas das views analíticas: SELECT, ordenação e chave única de cada resultado
+VIEWS = {
+    "vw_revenue_by_location": {
+        "query": """
             SELECT
                 us.city,
                 us.state,
@@ -99,10 +309,12 @@ def create_views(cursor):
             LEFT JOIN dim_users AS us
                 ON us.user_id = sa.user_id
             GROUP BY us.city, us.state, us.country
-            ORDER BY revenue_total DESC;
         """,
-        "vw_top_selling_product": """
-            CREATE OR REPLACE VIEW vw_top_selling_product AS 
+        "order_by": "revenue_total DESC",
+        "keys": ["city", "state", "country"]
+    },
+    "vw_top_selling_product": {
+        "query": """
             SELECT 
                 pr.product_id,
                 pr.title,
@@ -112,10 +324,12 @@ def create_views(cursor):
             LEFT JOIN dim_products AS pr
                 ON sa.product_id = pr.product_id
             GROUP BY pr.product_id, pr.title, pr.brand
-            ORDER BY revenue DESC;
         """,
-        "vw_top_brand_selling_state": """
-            CREATE OR REPLACE VIEW vw_top_brand_selling_state AS
+        "order_by": "revenue DESC",
+        "keys": ["product_id"]
+    },
+    "vw_top_brand_selling_state": {
+        "query": """
             SELECT
                 pr.brand,
                 us.state,
@@ -126,10 +340,12 @@ def create_views(cursor):
             LEFT JOIN dim_users AS us
                 ON sa.user_id = us.user_id
             GROUP BY us.state, pr.brand
-            ORDER BY revenue DESC;
         """,
-        "vw_rating_sales": """
-            CREATE OR REPLACE VIEW vw_rating_sales AS
+        "order_by": "revenue DESC",
+        "keys": ["brand", "state"]
+    },
+    "vw_rating_sales": {
+        "query": """
             SELECT
                 pr.product_id,
                 pr.title,
@@ -141,10 +357,12 @@ def create_views(cursor):
             LEFT JOIN dim_products AS pr
                 ON sa.product_id = pr.product_id
             GROUP BY pr.product_id, pr.title, pr.brand, pr.rating
-            ORDER BY total_units_sold DESC;
         """,
-        "vw_top_selling_months": """
-            CREATE OR REPLACE VIEW vw_top_selling_months AS
+        "order_by": "total_units_sold DESC",
+        "keys": ["product_id"]
+    },
+    "vw_top_selling_months": {
+        "query": """
             SELECT 
                 CASE ti.month
                     WHEN 1 THEN 'Janeiro'
@@ -165,148 +383,506 @@ def create_views(cursor):
             LEFT JOIN dim_time AS ti
                 ON sa.time_id = ti.time_id
             GROUP BY ti.month
-            ORDER BY revenue DESC;
-        """
+        """,
+        "order_by": "revenue DESC",
+        "keys": ["month"]
     }
+}
 
+# Nome da view materializada que guarda o resultado de uma view analítica
+def materialized_name(view_name: str) -> str:
+    return "mv_" + view_name.removeprefix("vw_")
+
+# Cria a view materializada (ou a atualiza, se já existir) e aponta a view vw_* para ela
+def create_materialized_view(cursor, view_name: str, view: dict):
+    mv_name = materialized_name(view_name)
+    cursor.execute("SELECT to_regclass(%s);", (mv_name,))
+    if cursor.fetchone()[0] is None:
+        cursor.execute(f"CREATE MATERIALIZED VIEW {mv_name} AS {view['query']};")
+        # Índice único permite REFRESH ... CONCURRENTLY (leituras não são bloqueadas durante a atualização)
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{mv_name} ON {mv_name} ({', '.join(view['keys'])}) NULLS NOT DISTINCT;")
+    else:
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {mv_name};")
+    # A view mantém o nome e a ordenação originais, mas lê o resultado já agregado
+    cursor.execute(f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM {mv_name} ORDER BY {view['order_by']};")
+
+# Função para criar todas as views definidas (no modo materializado, também as atualiza)
+@instrument
+def create_views(cursor, mode: str | None = None):
+    mode = mode or VIEWS_MODE
     # Criação das views iterativamente
-    for view_name, sql in views.items():
+    for view_name, view in VIEWS.items():
         try:
             print(f"[INFO] Criando view '{view_name}'...")
-            cursor.execute(sql)
+            if mode == "materialized":
+                create_materialized_view(cursor, view_name, view)
+            else:
+                cursor.execute(f"CREATE OR REPLACE VIEW {view_name} AS {view['query']} ORDER BY {view['order_by']};")
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {materialized_name(view_name)};")
             print(f"[SUCCESS] View '{view_name}' criada ou atualizada com sucesso.")
         except Exception as e:
             print(f"[ERROR] Falha ao criar view '{view_name}': {e}")
 
+# Percorre o plano (EXPLAIN em JSON) e retorna os índices usados
+def plan_indexes(plan: dict) -> set:
+    indexes = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        indexes |= plan_indexes(child)
+    return indexes
+
+# Confere, via EXPLAIN, quais índices cada consulta das views analíticas usa
+def check_view_plans(cursor) -> dict:
+    cursor.execute("ANALYZE fact_sales;")             # Estatísticas atualizadas para o planejador
+    usage = {}
+    for view_name, view in VIEWS.items():
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {view['query']}")
+        plan = cursor.fetchone()[0][0]['Plan']
+        usage[view_name] = sorted(plan_indexes(plan))
+        if usage[view_name]:
+            logging.info(f"View {view_name} usa os índices: {', '.join(usage[view_name])}")
+        else:
+            logging.warning(f"View {view_name} não usa índices (plano: {plan['Node Type']})")
+    return usage
+
+# Serializa o DataFrame em CSV num buffer em memória, no formato esperado pelo COPY
+def to_copy_buffer(records: pd.DataFrame) -> io.StringIO:
+    records = records.copy(deep=False)
+    for col in records.columns:
+        values = records[col]
+        # Floats inteiros (ex.: ids que viraram float por causa de NaN) são escritos sem ".0",
+        # pois o COPY não converte '29.0' para colunas INT como o INSERT faz
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            records[col] = values.astype('Int64')
+    buffer = io.StringIO()
+    records.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    return buffer
+
+# Cláusula ON CONFLICT: sem update, registros existentes são ignorados; com update, as colunas
+# informadas são atualizadas apenas se algum valor mudou
+def conflict_clause(table: str, conflict: str, update: list | None = None) -> str:
+    if not update:
+        return f"ON CONFLICT ({conflict}) DO NOTHING"
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in update)
+    current = ", ".join(f"{table}.{column}" for column in update)
+    excluded = ", ".join(f"EXCLUDED.{column}" for column in update)
+    return f"ON CONFLICT ({conflict}) DO UPDATE SET {assignments} WHERE ({current}) IS DISTINCT FROM ({excluded})"
+
+# Insere registros via COPY em uma tabela temporária e mescla no destino com um único INSERT ... SELECT.
+# Com returning, retorna as linhas do RETURNING (registros inseridos ou atualizados) em vez da contagem
+def copy_records(cursor, table: str, columns: list, records: pd.DataFrame, conflict: str,
+                 returning: str | None = None, update: list | None = None) -> int | list:
+    staging = f"stg_{table}"
+    cols = ", ".join(columns)
+    # Tabela temporária com os mesmos tipos das colunas de destino (sem restrições), descartada no commit
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA;")
+    cursor.execute(f"TRUNCATE {staging};")
+    cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", to_copy_buffer(records))
+    cursor.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT {cols} FROM {staging}
+        {conflict_clause(table, conflict, update)}
+        {f"RETURNING {returning}" if returning else ""};
+    """)
+    return cursor.fetchall() if returning else cursor.rowcount
+
+# Insere registros no destino usando o backend configurado (PG_LOAD_METHOD); retorna as linhas inseridas
+# (ou, com returning, as linhas do RETURNING de todos os registros inseridos). Com update, registros
+# existentes com valores diferentes nessas colunas são atualizados
+def insert_records(cursor, table: str, columns: list, records: pd.DataFrame, conflict: str,
+                   returning: str | None = None, update: list | None = None) -> int | list:
+    if LOAD_METHOD == 'copy':
+        return copy_records(cursor, table, columns, records, conflict, returning, update)
+    result = execute_values(cursor, f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES %s
+        {conflict_clause(table, conflict, update)}
+        {f"RETURNING {returning}" if returning else ""};
+    """, records.values.tolist(), fetch=bool(returning))
+    return result if returning else cursor.rowcount  # Sem RETURNING, apenas a última página é contabilizada
+
+# Tabela de staging de cada worker da carga paralela (UNLOGGED: visível às demais conexões, sem WAL),
+# com nome único por carga para que cargas simultâneas não compartilhem tabelas.
+# Os tipos são declarados explicitamente, pois a fact_sales pode ter sido criada na transação ainda aberta
+FACT_STAGING_SQL = """
+    CREATE UNLOGGED TABLE {staging} (
+        user_id INT,
+        product_id INT,
+        time_id INT,
+        unit_price NUMERIC(10,2),
+        quantity INT
+    );
+"""
+
+# Número de conexões da carga paralela da fact_sales para `rows` registros (1 = carga serial)
+def fact_load_workers(rows: int) -> int:
+    if FACT_LOAD_WORKERS <= 1 or LOAD_METHOD != 'copy' or rows < PARALLEL_MIN_ROWS:
+        return 1
+    available = int(os.getenv("PG_POOL_MAX", "5")) - 1   # Uma conexão do pool é a da transação principal
+    if FACT_LOAD_WORKERS > available:
+        logging.warning(f"PG_FACT_LOAD_WORKERS={FACT_LOAD_WORKERS} limitado a {available} pelo PG_POOL_MAX")
+    return max(1, min(FACT_LOAD_WORKERS, available))
+
+# Copia uma partição dos fatos para a tabela de staging do worker, em uma conexão própria do pool
+def copy_fact_partition(staging: str, columns: list, records: pd.DataFrame):
+    conn = connections.get_pg_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(FACT_STAGING_SQL.format(staging=staging))
+            cursor.copy_expert(f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                               to_copy_buffer(records))
+        conn.commit()                                      # Torna a partição visível à transação principal
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        connections.release_pg_connection(conn)
+
+# Tabelas de staging da carga paralela criadas nesta carga; removidas junto com a mescla, mas voltam
+# a existir se a transação principal for revertida (ver drop_fact_stagings)
+_fact_stagings = set()
+
+# Remove, em uma conexão própria, as tabelas de staging que sobraram de uma carga revertida
+# (chamada após o rollback da transação principal, que pode manter locks sobre elas)
+def drop_fact_stagings():
+    if not _fact_stagings:
+        return
+    conn = connections.get_pg_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(sorted(_fact_stagings))};")
+        conn.commit()
+        _fact_stagings.clear()
+    except Exception as e:
+        conn.rollback()
+        logging.warning(f"Não foi possível remover as tabelas de staging da fact_sales: {e}")
+    finally:
+        connections.release_pg_connection(conn)
+
+def parallel_insert_facts(cursor, columns: list, records: pd.DataFrame, workers: int) -> int:
+    """
+    Carrega os fatos em paralelo: os registros são divididos por hash de
+    (user_id, product_id, time_id) e cada partição é copiada (COPY) para a
+    tabela de staging de um worker, em uma conexão própria do pool. Um
+    único INSERT ... SELECT na transação principal mescla as partições na
+    fact_sales com ON CONFLICT DO NOTHING. Registros com a mesma chave
+    ficam na mesma partição e na ordem original, então o registro mantido
+    para cada unique_sale é o mesmo da carga serial; uma falha em qualquer
+    worker interrompe a carga antes da mescla (tudo ou nada). As tabelas
+    de staging têm um sufixo único por chamada e são removidas (DROP) na
+    transação principal logo após a mescla; se a carga for revertida, o
+    run_load as remove com drop_fact_stagings.
+    Retorna o número de registros inseridos.
+    """
+    partitions = pd.util.hash_pandas_object(records[['user_id', 'id', 'time_id']], index=False).to_numpy() % workers
+    suffix = uuid.uuid4().hex[:12]
+    stagings = [f"stg_fact_sales_{suffix}_w{number}" for number in range(workers)]
+    _fact_stagings.update(stagings)
+    logging.info(f"Carregando fact_sales em {workers} partições paralelas")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_fact_partition, staging, columns, records[partitions == number])
+                   for number, staging in enumerate(stagings)]
+        for future in futures:
+            future.result()                                # Propaga a falha de qualquer worker
+
+    cols = ", ".join(columns)
+    partitions_sql = " UNION ALL ".join(f"SELECT {cols} FROM {staging}" for staging in stagings)
+    cursor.execute(f"""
+        INSERT INTO fact_sales ({cols})
+        {partitions_sql}
+        ON CONFLICT (user_id, product_id, time_id) DO NOTHING;
+    """)
+    inserted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {', '.join(stagings)};")  # Nenhuma cópia dos fatos fica no banco após a mescla
+    return inserted
+
+# Hash de 64 bits dos atributos de cada linha (números como float64 e demais valores como objetos Python,
+# para que o hash não dependa do dtype: category, string[pyarrow], int8 e int64 geram o mesmo valor)
+def row_hashes(records: pd.DataFrame) -> np.ndarray:
+    normalized = pd.DataFrame({
+        column: values.astype('float64') if pd.api.types.is_numeric_dtype(values) else values.astype(object)
+        for column, values in records.items()
+    })
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy().view('int64')
+
+# SCD tipo 2: encerra a versão atual (valid_to) dos registros cujo row_hash vai mudar. Registros
+# gravados antes do modo scd2 não têm versões; a linha atual é guardada como versão encerrada
+def close_versions(cursor, table: str, key: str, columns: list, batch: pd.DataFrame):
+    cols = ", ".join(columns)
+    cursor.execute(f"""
+        WITH incoming ({key}, row_hash) AS (
+            SELECT * FROM unnest(%s::bigint[], %s::bigint[])
+        ),
+        changed AS (
+            SELECT {table}.* FROM {table} JOIN incoming USING ({key})
+            WHERE {table}.row_hash IS DISTINCT FROM incoming.row_hash
+        ),
+        archived AS (
+            INSERT INTO {table}_history ({cols}, valid_from, valid_to)
+            SELECT {cols}, NULL, now() FROM changed
+            WHERE NOT EXISTS (SELECT 1 FROM {table}_history AS history WHERE history.{key} = changed.{key})
+        )
+        UPDATE {table}_history AS history SET valid_to = now()
+        FROM changed
+        WHERE history.{key} = changed.{key} AND history.valid_to IS NULL;
+    """, (batch.iloc[:, 0].tolist(), batch['row_hash'].tolist()))
+
+# SCD tipo 2: abre a versão atual dos registros inseridos ou atualizados (valores já gravados na dimensão)
+def open_versions(cursor, table: str, key: str, columns: list, written: list):
+    cols = ", ".join(columns)
+    cursor.execute(f"""
+        INSERT INTO {table}_history ({cols}, valid_from)
+        SELECT {cols}, now() FROM {table} WHERE {key} = ANY(%s);
+    """, ([row[0] for row in written],))
+
+def upsert_dimension(cursor, table: str, columns: list, records: pd.DataFrame, load_id: str | None = None) -> list:
+    """
+    Carrega uma dimensão com detecção de mudanças: o hash dos atributos de
+    cada registro (row_hash) é comparado com o cache de chaves, e apenas
+    os registros que precisam ser gravados são enviados ao banco. No modo
+    'insert' (PG_DIM_CHANGE_MODE) são os registros novos; em 'update' e
+    'scd2', também os alterados, que são atualizados (em 'scd2' com a
+    versão anterior encerrada em <dimensão>_history). A primeira coluna é
+    a chave. Retorna as linhas do RETURNING dos registros gravados.
+    """
+    keys.get_keys(cursor, table)               # Cache conferido antes da inserção
+    key = columns[0]
+    columns = columns + ['row_hash']
+    records = records.assign(row_hash=row_hashes(records.iloc[:, 1:]))
+    if DIM_CHANGE_MODE == 'insert':
+        pending = np.isnan(keys.lookup(cursor, table, records.iloc[:, 0]))
+        update = None
+        ignored = int((keys.changed(cursor, table, records.iloc[:, 0], records['row_hash'].to_numpy()) & ~pending).sum())
+        if ignored > 0:
+            logging.warning(f"{table}: {ignored} registros existentes com atributos alterados não foram atualizados "
+                            f"(PG_DIM_CHANGE_MODE=insert)")
+    else:
+        # Um registro por chave (o último extraído, o mais recente), pois cada chave só pode ser atualizada uma vez
+        records = records[~records.iloc[:, 0].duplicated(keep='last')]
+        pending = keys.changed(cursor, table, records.iloc[:, 0], records['row_hash'].to_numpy())
+        update = columns[1:]
+    logging.info(f"{table}: {int(pending.sum())} registros novos ou alterados, {int((~pending).sum())} inalterados ignorados")
+    records = records[pending]
+    if records.empty:
+        return []
+
+    def insert(batch: pd.DataFrame) -> list:
+        if DIM_CHANGE_MODE == 'scd2':
+            close_versions(cursor, table, key, columns, batch)
+        written = insert_records(cursor, table, columns, batch, key, returning=keys.key_columns(table), update=update)
+        if DIM_CHANGE_MODE == 'scd2' and written:
+            open_versions(cursor, table, key, columns, written)
+        return written
+
+    written = sum(insert_batches(cursor, table, records, insert, load_id), [])
+    keys.add_keys(cursor, table, written)      # Chaves novas e hashes atualizados entram no cache
+    return written
+
 # Função para carregar dimensão de usuários
-def load_dim_users(data_users: pd.DataFrame, cursor):
+@instrument
+def load_dim_users(data_users: pd.DataFrame, cursor, load_id: str | None = None):
     logging.info(f"Iniciando carga da dimensão users ({len(data_users)} registros)")
     if data_users.empty:
         logging.warning("DataFrame de usuários vazio")
         return
-    execute_values(cursor, """
-        INSERT INTO dim_users (user_id, first_name, last_name, age, gender, city, state, country)
-        VALUES %s
-        ON CONFLICT (user_id) DO NOTHING;
-    """, data_users[['id', 'firstName', 'lastName', 'age', 'gender', 'city', 'state', 'country']].drop_duplicates().values.tolist())
-    logging.info(f"Dim_users concluída, registros inseridos: {cursor.rowcount}")
+    columns = ['user_id', 'first_name', 'last_name', 'age', 'gender', 'city', 'state', 'country']
+    records = data_users[['id', 'firstName', 'lastName', 'age', 'gender', 'city', 'state', 'country']].drop_duplicates()
+    written = upsert_dimension(cursor, 'dim_users', columns, records, load_id)
+    logging.info(f"Dim_users concluída, registros inseridos ou atualizados: {len(written)}")
 
 # Função para carregar dimensão de produtos
-def load_dim_products(data_products: pd.DataFrame, cursor):
+@instrument
+def load_dim_products(data_products: pd.DataFrame, cursor, load_id: str | None = None):
     logging.info(f"Iniciando carga da dimensão products ({len(data_products)} registros)")
     if data_products.empty:
         logging.warning("DataFrame de produtos vazio")
         return
-    execute_values(cursor, """
-        INSERT INTO dim_products (product_id, title, price, rating, brand)
-        VALUES %s
-        ON CONFLICT (product_id) DO NOTHING;
-    """, data_products[['id', 'title', 'price', 'rating', 'brand']].drop_duplicates().values.tolist())
-    logging.info(f"Dim_products concluída, registros inseridos: {cursor.rowcount}")
+    columns = ['product_id', 'title', 'price', 'rating', 'brand']
+    records = data_products[['id', 'title', 'price', 'rating', 'brand']].drop_duplicates()
+    written = upsert_dimension(cursor, 'dim_products', columns, records, load_id)
+    logging.info(f"Dim_products concluída, registros inseridos ou atualizados: {len(written)}")
 
 # Função para carregar dimensão de tempo
-def load_dim_time(data_carts: pd.DataFrame, cursor):
+@instrument
+def load_dim_time(data_carts: pd.DataFrame, cursor, load_id: str | None = None, step: str = 'dim_time'):
     logging.info("Iniciando carga da dimensão time")
     if data_carts.empty:
         logging.warning("DataFrame de carrinhos vazio")
-        return pd.DataFrame(columns=['time_id', 'transaction_date'])
-    
-    # Converter coluna de datas para datetime
+        return
+
+    # Datas distintas dos carrinhos (convertidas para datetime)
     try:
-        data_carts['transaction_date'] = pd.to_datetime(data_carts['transaction_date'])
+        dates = pd.DataFrame({'date': pd.to_datetime(data_carts['transaction_date']).drop_duplicates()})
     except Exception as e:
         logging.error(f"Erro ao converter datas: {e}")
         raise
+    # Apenas datas que ainda não estão na dimensão (segundo o cache de chaves) são enviadas ao banco
+    dates = dates[np.isnan(keys.lookup(cursor, 'dim_time', dates['date']))]
 
     # Extrair ano, mês e dia
-    data_carts['ano'] = data_carts['transaction_date'].dt.year
-    data_carts['mes'] = data_carts['transaction_date'].dt.month
-    data_carts['dia'] = data_carts['transaction_date'].dt.day
+    dates['ano'] = dates['date'].dt.year
+    dates['mes'] = dates['date'].dt.month
+    dates['dia'] = dates['date'].dt.day
 
-    # Inserção em lote com ON CONFLICT para evitar duplicidade
-    execute_values(cursor, """
-        INSERT INTO dim_time (date, year, month, day)
-        VALUES %s
-        ON CONFLICT (date) DO NOTHING;
-    """, data_carts[['transaction_date', 'ano', 'mes', 'dia']].drop_duplicates().values.tolist())
-    logging.info(f"Dim_time carregada, registros inseridos: {cursor.rowcount}")
-
-    # Recupera time_id gerados no banco
-    cursor.execute("SELECT time_id, date FROM dim_time;")
-    time_map = pd.DataFrame(cursor.fetchall(), columns=['time_id', 'transaction_date'])
-    logging.info(f"Recuperados {len(time_map)} registros de time_id")
-    return time_map
-
-# Função para fazer merge de carts com usuários
-def merge_dfs(data_carts: pd.DataFrame, data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Iniciando merge de carts e users")
-    merged = pd.merge(data_carts, data_users, how='left', left_on='userId', right_on='id')\
-        .rename(columns={'id_x': 'cart_id', 'id_y': 'user_id'})
-    missing_users = merged['user_id'].isna().sum()
+    # Inserção em lote com ON CONFLICT para evitar duplicidade; os time_id gerados voltam pelo RETURNING
+    inserted = sum(insert_batches(cursor, step, dates, lambda batch: insert_records(
+        cursor, 'dim_time', ['date', 'year', 'month', 'day'], batch, 'date', returning=keys.key_columns('dim_time')),
+        load_id), []) \
+        if not dates.empty else []
+    keys.add_keys(cursor, 'dim_time', inserted)
+    logging.info(f"Dim_time carregada, registros inseridos: {len(inserted)}")
+
+# Resolve as chaves de usuário e de tempo de cada carrinho pelo cache de chaves (sem merges)
+@instrument
+def resolve_keys(data_carts: pd.DataFrame, cursor) -> pd.DataFrame:
+    logging.info("Resolvendo chaves de usuário e tempo dos carrinhos")
+    if data_carts.empty:
+        logging.warning("DataFrame de carrinhos vazio")
+        return data_carts
+    data_carts = data_carts.reset_index(drop=True)
+    data_carts['user_id'] = keys.lookup(cursor, 'dim_users', data_carts['userId'])
+    data_carts['time_id'] = keys.lookup(cursor, 'dim_time', data_carts['transaction_date'])
+    missing_users = int(data_carts['user_id'].isna().sum())
     if missing_users > 0:
         logging.warning(f"{missing_users} carrinhos não possuem usuário correspondente")
-    logging.info(f"Merge concluído: {len(merged)} registros")
-    return merged
+    missing_time = int(data_carts['time_id'].isna().sum())
+    if missing_time > 0:
+        logging.warning(f"{missing_time} registros não possuem time_id correspondente")
+    return data_carts
 
 # Função para carregar tabela de fatos de vendas
-def load_fact_sales(carts_users: pd.DataFrame, cursor, time_df: pd.DataFrame):
+@instrument
+def load_fact_sales(merged: pd.DataFrame, cursor, load_id: str | None = None, step: str = 'fact_sales'):
     logging.info("Iniciando carga da fact_sales")
-    if carts_users.empty:
+    if merged.empty:
         logging.warning("DataFrame de vendas vazio")
         return
 
-    # Conversão de datas para merge com dimensão de tempo
-    carts_users['transaction_date'] = pd.to_datetime(carts_users['transaction_date'])
-    time_df['transaction_date'] = pd.to_datetime(time_df['transaction_date'])
-
-    # Merge para adicionar time_id
-    merged = carts_users.merge(time_df, on='transaction_date', how='left')
-    missing_time = merged['time_id'].isna().sum()
-    if missing_time > 0:
-        logging.warning(f"{missing_time} registros não possuem time_id correspondente")
-
-    # Explode lista de produtos em linhas separadas
-    carts_exploded = merged.explode('products').reset_index(drop=True)
-    products_df = pd.json_normalize(carts_exploded['products'])  # Normaliza dict de produtos
-    products_df['user_id'] = carts_exploded['user_id']
-    products_df['time_id'] = carts_exploded['time_id']
-    products_df['price'] = products_df.get('price', 0)
-    products_df['quantity'] = products_df['quantity']
+    # Uma linha por item do carrinho, com usuário e time_id do carrinho de origem
+    if 'products' in merged.columns:
+        line_items = flatten_line_items(merged)
+        carts = merged[['user_id', 'time_id']].loc[line_items['cart_index']]
+    else:
+        # Carts já achatados em itens (ETL_CARTS_PUSHDOWN); carrinhos sem itens não têm item_index
+        line_items = carts = merged[merged['item_index'].notna()]
 
     # Prepara registros para inserção
-    records_to_insert = products_df[['user_id', 'id', 'time_id', 'price', 'quantity']].values.tolist()
+    records_to_insert = pd.DataFrame({
+        'user_id': carts['user_id'].to_numpy(),
+        'id': line_items['product_id'].to_numpy(),
+        'time_id': carts['time_id'].to_numpy(),
+        'price': line_items['price'].to_numpy(),
+        'quantity': line_items['quantity'].to_numpy(),
+    })
     logging.info(f"Total de registros a tentar inserir na fact_sales: {len(records_to_insert)}")
+    missing_products = int(np.isnan(keys.lookup(cursor, 'dim_products', records_to_insert['id'])).sum())
+    if missing_products > 0:
+        logging.warning(f"{missing_products} itens referenciam produtos ausentes da dim_products")
+    ensure_fact_partitions(cursor, records_to_insert['time_id'].max())  # Partições para os time_id do lote
 
-    # Inserção em lote na fact_sales
-    execute_values(cursor, """
-        INSERT INTO fact_sales (user_id, product_id, time_id, unit_price, quantity)
-        VALUES %s
-        ON CONFLICT (user_id, product_id, time_id) DO NOTHING;
-    """, records_to_insert)
-    logging.info(f"Fact_sales concluída, registros inseridos aproximadamente: {cursor.rowcount}")
+    # Inserção em lote na fact_sales (em partições paralelas com PG_FACT_LOAD_WORKERS > 1)
+    # Com checkpoints (load_id), cada lote de PG_LOAD_BATCH_SIZE registros é confirmado separadamente
+    columns = ['user_id', 'product_id', 'time_id', 'unit_price', 'quantity']
+
+    def insert(records: pd.DataFrame) -> int:
+        workers = fact_load_workers(len(records))
+        if workers > 1:
+            return parallel_insert_facts(cursor, columns, records, workers)
+        return insert_records(cursor, 'fact_sales', columns, records, 'user_id, product_id, time_id')
+
+    inserted = sum(insert_batches(cursor, step, records_to_insert, insert, load_id))
+    logging.info(f"Fact_sales concluída, registros inseridos: {inserted}")
 
 # Função principal para rodar todo o ETL
-def run_load(data_carts: pd.DataFrame, data_products: pd.DataFrame, data_users: pd.DataFrame):
+def run_load(data_carts: pd.DataFrame, data_products: pd.DataFrame, data_users: pd.DataFrame,
+             watermarks: dict | None = None, incremental: bool = False):
     logging.info("Iniciando ETL completo")
     conn = connect_db()
     cursor = conn.cursor()
+    keys.start_load()                                      # Cache de chaves conferido com o banco nesta carga
+    # Com PG_LOAD_BATCH_SIZE, cada lote é confirmado com seu checkpoint e uma nova execução retoma a carga
+    load_id = checkpoint_id(watermarks)
 
     try:
         create_tables(cursor)                              # Cria todas as tabelas
-        load_dim_users(data_users, cursor)                 # Carrega dimensão users
-        load_dim_products(data_products, cursor)           # Carrega dimensão products
-        time_df = load_dim_time(data_carts, cursor)        # Carrega dimensão time
-        carts_users = merge_dfs(data_carts, data_users)    # Faz merge de carrinhos e usuários
-        load_fact_sales(carts_users, cursor, time_df)      # Carrega tabela de fatos
+        started_at = load_started_at(cursor)
+        if load_id is not None:
+            conn.commit()                                  # Tabelas (e de checkpoints) visíveis antes dos lotes
+        load_dim_users(data_users, cursor, load_id)        # Carrega dimensão users
+        load_dim_products(data_products, cursor, load_id)  # Carrega dimensão products
+        load_dim_time(data_carts, cursor, load_id)         # Carrega dimensão time
+        # Usuário e time_id de cada carrinho pelo cache de chaves (inclui usuários de cargas anteriores)
+        carts_keys = resolve_keys(data_carts, cursor)
+        load_fact_sales(carts_keys, cursor, load_id)       # Carrega tabela de fatos
         create_views(cursor)                               # Cria as views de análise
+        if EXPLAIN_VIEWS:
+            check_view_plans(cursor)                       # Registra os índices usados pelas views
+        save_watermarks(cursor, watermarks or {})          # Marca d'água só avança junto com a carga
+        clear_checkpoints(cursor, load_id, started_at)                 # Carga concluída: checkpoints não são mais necessários
         conn.commit()                                      # Confirma todas as alterações no banco
+        keys.save()                                        # Cache de chaves persistido após o commit
+        _fact_stagings.clear()                             # Staging removido na transação confirmada
         logging.info("Commit realizado com sucesso")
     except Exception as e:
         logging.error(f"Erro durante o ETL: {e}")
         conn.rollback()                                    # Reverte alterações em caso de erro
+        keys.discard()                                     # Chaves revertidas não podem ficar no cache
+        drop_fact_stagings()                               # Staging da carga paralela restaurado pelo rollback
+        logging.info("Rollback executado devido a erro")
+        raise
+    finally:
+        cursor.close()
+        release_db(conn)
+        logging.info("Conexão com PostgreSQL devolvida ao pool")
+
+# Carga a partir do staging em Parquet (ETL_STAGING_DIR), sem repetir a extração e a transformação
+def run_load_staged(directory: str | None = None):
+    data_carts, data_products, data_users, watermarks, incremental = read_staging(directory)
+    run_load(data_carts, data_products, data_users, watermarks, incremental)
+
+# Carga em modo streaming: dimensões primeiro e depois a fact_sales lote a lote
+def run_load_stream(carts_chunks, data_products: pd.DataFrame, data_users: pd.DataFrame,
+                    watermarks: dict | None = None, incremental: bool = False):
+    logging.info("Iniciando carga em modo streaming")
+    conn = connect_db()
+    cursor = conn.cursor()
+    keys.start_load()                                      # Cache de chaves conferido com o banco nesta carga
+    load_id = checkpoint_id(watermarks)                    # Checkpoints por lote (PG_LOAD_BATCH_SIZE)
+
+    try:
+        create_tables(cursor)                              # Cria todas as tabelas
+        started_at = load_started_at(cursor)
+        if load_id is not None:
+            conn.commit()
+        load_dim_users(data_users, cursor, load_id)        # Carrega dimensão users
+        load_dim_products(data_products, cursor, load_id)  # Carrega dimensão products
+        conn.commit()                                      # Dimensões confirmadas antes dos lotes de fatos
+
+        # Cada lote é transformado, carregado e confirmado antes da leitura do próximo
+        for chunk_number, data_carts in enumerate(carts_chunks, start=1):
+            load_dim_time(data_carts, cursor, load_id, step=f"dim_time:{chunk_number}")  # Datas do lote
+            carts_keys = resolve_keys(data_carts, cursor)      # Usuário e time_id do lote pelo cache de chaves
+            load_fact_sales(carts_keys, cursor, load_id, step=f"fact_sales:{chunk_number}")  # Fatos do lote
+            conn.commit()
+            logging.info(f"Lote {chunk_number} confirmado no PostgreSQL")
+
+        create_views(cursor)                               # Cria as views de análise
+        if EXPLAIN_VIEWS:
+            check_view_plans(cursor)                       # Registra os índices usados pelas views
+        save_watermarks(cursor, watermarks or {})          # Marca d'água só avança após o último lote
+        clear_checkpoints(cursor, load_id, started_at)
+        conn.commit()
+        keys.save()                                        # Cache de chaves persistido após o commit
+        _fact_stagings.clear()                             # Staging removido na transação confirmada
+        logging.info("Carga em streaming concluída")
+    except Exception as e:
+        logging.error(f"Erro durante a carga em streaming: {e}")
+        conn.rollback()                                    # Reverte apenas o lote em andamento
+        keys.discard()                                     # Chaves revertidas não podem ficar no cache
+        drop_fact_stagings()                               # Staging da carga paralela restaurado pelo rollback
         logging.info("Rollback executado devido a erro")
         raise
     finally:
         cursor.close()
-        conn.close()
-        logging.info("Conexão com PostgreSQL fechada")
+        release_db(conn)
+        logging.info("Conexão com PostgreSQL devolvida ao pool")
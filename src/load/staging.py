@@ -0,0 +1,149 @@
+import glob
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ..metrics import instrument
+from ..transform.line_items import flatten_line_items
+
+# Configuração global de logs
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Diretório da área de staging em Parquet (vazio = transformação e carga apenas em memória)
+STAGING_DIR = os.getenv("ETL_STAGING_DIR")
+# Máximo de registros por arquivo Parquet de cada entidade
+PART_ROWS = int(os.getenv("ETL_STAGING_PART_ROWS", "1000000"))
+# Compressão dos arquivos Parquet
+COMPRESSION = os.getenv("ETL_STAGING_COMPRESSION", "zstd")
+
+MANIFEST = "manifest.json"
+
+# Colunas lidas por entidade na carga (projeção aplicada na leitura do Parquet)
+LOAD_COLUMNS = {
+    'users': ['id', 'firstName', 'lastName', 'age', 'gender', 'city', 'state', 'country'],
+    'products': ['id', 'title', 'price', 'rating', 'brand'],
+    'carts': ['cart_index', 'id', 'userId', 'transaction_date'],
+    'line_items': ['cart_index', 'item_index', 'product_id', 'price', 'quantity'],
+}
+
+def split_line_items(data_carts: pd.DataFrame) -> tuple:
+    """
+    Separa os carts em um DataFrame por carrinho (sem a coluna products) e
+    outro por item (cart_index, item_index, product_id, price, quantity),
+    ligados por cart_index (posição do carrinho). Aceita carts com a coluna
+    products ou já achatados em itens (ETL_CARTS_PUSHDOWN).
+    """
+    if 'products' in data_carts.columns:
+        carts = data_carts.drop(columns='products').reset_index(drop=True)
+        line_items = flatten_line_items(data_carts.reset_index(drop=True))
+    else:
+        # Uma linha por item; carrinhos sem itens têm uma única linha sem item_index
+        codes, _ = pd.factorize(data_carts['_id'])
+        item_columns = ['item_index', 'product_id', 'price', 'quantity']
+        carts = data_carts[~data_carts['_id'].duplicated()].drop(columns=item_columns).reset_index(drop=True)
+        has_item = data_carts['item_index'].notna().to_numpy()
+        line_items = data_carts.loc[has_item, ['product_id', 'price', 'quantity']].reset_index(drop=True)
+        line_items.insert(0, 'cart_index', codes[has_item])
+    line_items.insert(1, 'item_index', line_items.groupby('cart_index').cumcount().to_numpy())
+    carts.insert(0, 'cart_index', np.arange(len(carts)))
+    return carts, line_items
+
+# Converte o DataFrame em tabela do pyarrow; colunas object com valores sem tipo equivalente
+# no Parquet (ex.: ObjectId, tipos mistos) são gravadas como texto
+def to_arrow_table(data: pd.DataFrame, entity: str) -> pa.Table:
+    data = data.reset_index(drop=True)
+    converted = []
+    for column in data.columns:
+        if data[column].dtype == object:
+            try:
+                pa.array(data[column].to_numpy(), from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                data[column] = data[column].astype(str)
+                converted.append(column)
+    if converted:
+        logging.warning(f"Colunas de '{entity}' gravadas como texto no staging: {converted}")
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+# Grava uma entidade em arquivos part-NNNNN.parquet de até PART_ROWS registros
+def write_entity(directory: str, entity: str, data: pd.DataFrame) -> int:
+    entity_dir = os.path.join(directory, entity)
+    os.makedirs(entity_dir, exist_ok=True)
+    table = to_arrow_table(data, entity)
+    for number, start in enumerate(range(0, max(table.num_rows, 1), PART_ROWS)):
+        pq.write_table(table.slice(start, PART_ROWS), os.path.join(entity_dir, f"part-{number:05d}.parquet"),
+                       compression=COMPRESSION)
+    return table.num_rows
+
+@instrument
+def write_staging(data_carts: pd.DataFrame, data_products: pd.DataFrame, data_users: pd.DataFrame,
+                  watermarks: dict | None = None, incremental: bool = False, directory: str | None = None) -> str:
+    """
+    Grava as entidades transformadas (carts, line_items, products e users)
+    em Parquet comprimido no diretório de staging, com um manifest.json
+    (marcas d'água, tipo de carga e registros por entidade). O conteúdo é
+    gravado em um diretório temporário e só então substitui o anterior,
+    de modo que leitores nunca encontram um staging incompleto.
+    """
+    directory = directory or STAGING_DIR
+    temporary = f"{directory}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    carts, line_items = split_line_items(data_carts) if not data_carts.empty else (data_carts, pd.DataFrame())
+    entities = {'carts': carts, 'line_items': line_items, 'products': data_products, 'users': data_users}
+    rows = {entity: write_entity(temporary, entity, data) for entity, data in entities.items()}
+    manifest = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'incremental': incremental,
+        'watermarks': {name: str(value) for name, value in (watermarks or {}).items() if value is not None},
+        'rows': rows,
+    }
+    with open(os.path.join(temporary, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    logging.info(f"Staging gravado em '{directory}': {rows}")
+    return directory
+
+# Lê uma entidade do staging (arquivos mapeados em memória, apenas as colunas pedidas que existirem)
+def read_entity(directory: str, entity: str, columns: list | None = None) -> pd.DataFrame:
+    paths = sorted(glob.glob(os.path.join(directory, entity, "part-*.parquet")))
+    if not paths:
+        return pd.DataFrame()
+    if columns is not None:
+        available = set(pq.read_schema(paths[0]).names)
+        columns = [column for column in columns if column in available]
+    tables = [pq.read_table(path, columns=columns, memory_map=True) for path in paths]
+    return pa.concat_tables(tables).to_pandas()
+
+# Reconstrói os carts com uma linha por item (formato do ETL_CARTS_PUSHDOWN, aceito pela carga);
+# carrinhos sem itens ficam com uma linha sem item_index
+def join_line_items(carts: pd.DataFrame, line_items: pd.DataFrame) -> pd.DataFrame:
+    if carts.empty:
+        return carts
+    if line_items.empty:
+        line_items = pd.DataFrame(columns=LOAD_COLUMNS['line_items'])
+    line_items = line_items.astype({'cart_index': 'int64'})
+    merged = carts.merge(line_items, on='cart_index', how='left')   # Mantém a ordem dos carrinhos e dos itens
+    return merged.drop(columns='cart_index')
+
+@instrument
+def read_staging(directory: str | None = None) -> tuple:
+    """
+    Lê o staging gravado por write_staging, apenas com as colunas usadas na
+    carga (LOAD_COLUMNS). Retorna carts (uma linha por item), products,
+    users, as marcas d'água e se a carga é incremental.
+    """
+    directory = directory or STAGING_DIR
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    data = {entity: read_entity(directory, entity, columns) for entity, columns in LOAD_COLUMNS.items()}
+    data_carts = join_line_items(data['carts'], data['line_items'])
+    logging.info(f"Staging lido de '{directory}' (gravado em {manifest['created_at']}): {manifest['rows']}")
+    return data_carts, data['products'], data['users'], manifest['watermarks'], manifest['incremental']
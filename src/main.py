@@ -1,11 +1,21 @@
+import argparse
 import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
+# Importa funções de extração (incremental e completa)
+from .extract.extract import extract_collection, get_max_object_id, build_watermark_query, invalidate_cache
 # Importa funções de transformação específicas de cada entidade
-from .transform.transform_carts import run_etl_carts
-from .transform.transform_products import run_etl_products
+from .transform.transform_carts import run_etl_carts, iter_etl_carts
+from .transform.transform_products import run_etl_products, PRODUCTS_FIELDS
 from .transform.transform_users import run_etl_users
 # Importa função de carga para PostgreSQL
-from .load.load import run_load, connect_db
+from .load.load import run_load, run_load_stream, run_load_staged, get_watermarks
+from .load import staging
+from .connections import pg_connection, close_connections
+from . import metrics
 
 # Configuração global de logs para todo o pipeline
 logging.basicConfig(
@@ -13,44 +23,216 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Formato com timestamp, nível e mensagem
 )
 
-def main() -> pd.DataFrame:
+# Coleções extraídas do MongoDB a cada execução
+COLLECTIONS = ['carts', 'products', 'users']
+
+def plan_extraction(full_refresh: bool):
+    """
+    Define o intervalo de _id a extrair de cada coleção. Em carga incremental,
+    apenas documentos posteriores à última marca d'água gravada no PostgreSQL
+    e anteriores ao maior _id atual (fixado no início da execução).
+    Retorna as consultas por coleção, as novas marcas d'água e se a carga é incremental.
+    """
+    upper = {name: get_max_object_id(name) for name in COLLECTIONS}
+    if full_refresh:
+        logging.info("Carga completa solicitada: marcas d'água ignoradas")
+        return {name: None for name in COLLECTIONS}, upper, False
+
+    with pg_connection() as conn:
+        watermarks = get_watermarks(conn.cursor())
+    if not watermarks:
+        logging.info("Nenhuma marca d'água encontrada: executando carga completa")
+        return {name: None for name in COLLECTIONS}, upper, False
+
+    queries = {name: build_watermark_query(watermarks.get(name), upper[name]) for name in COLLECTIONS}
+    logging.info(f"Carga incremental a partir das marcas d'água: {watermarks}")
+    return queries, upper, True
+
+def build_etl_tasks(queries: dict) -> dict:
+    """
+    Monta o DAG de extração e transformação. Cada tarefa indica a função, os
+    argumentos fixos e as dependências (parâmetro -> tarefa que fornece o valor).
+    Apenas a validação de quantidade mínima dos carts depende de products.
+    """
+    tasks = {
+        # Extração completa de products, usada na validação dos carts
+        "products_raw": {"func": extract_collection, "kwargs": {"collection_name": "products", "fields": PRODUCTS_FIELDS, "use_cache": True}, "deps": {}},
+        "carts": {"func": run_etl_carts, "kwargs": {"query": queries['carts']}, "deps": {"data_products": "products_raw"}},
+        "users": {"func": run_etl_users, "kwargs": {"query": queries['users']}, "deps": {}},
+    }
+    if queries['products'] is None:
+        # Carga completa: o ETL de products reaproveita a extração já feita
+        tasks["products"] = {"func": run_etl_products, "kwargs": {}, "deps": {"raw_products": "products_raw"}}
+    else:
+        tasks["products"] = {"func": run_etl_products, "kwargs": {"query": queries['products']}, "deps": {}}
+    return tasks
+
+def get_executor(kind: str | None = None, max_workers: int | None = None):
+    """
+    Cria o executor do DAG conforme ETL_EXECUTOR (thread ou process) e
+    ETL_MAX_WORKERS. Processos usam 'spawn' para não herdar conexões abertas.
+    """
+    kind = (kind or os.getenv("ETL_EXECUTOR", "thread")).lower()
+    max_workers = max_workers or int(os.getenv("ETL_MAX_WORKERS", "3"))
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"ETL_EXECUTOR inválido: '{kind}' (use 'thread' ou 'process')")
+
+def run_dag(tasks: dict, executor=None) -> dict:
+    """
+    Executa as tarefas do DAG assim que suas dependências terminam, em
+    paralelo no executor informado. Retorna o resultado de cada tarefa.
+    Em caso de falha, as tarefas ainda não iniciadas são canceladas.
+    """
+    executor = executor or get_executor()
+    collect_metrics = metrics.ENABLED and isinstance(executor, ProcessPoolExecutor)
+    results, pending, running = {}, dict(tasks), {}
+    with executor:
+        while pending or running:
+            # Submete todas as tarefas cujas dependências já foram concluídas
+            for name, task in list(pending.items()):
+                if all(dep in results for dep in task["deps"].values()):
+                    kwargs = dict(task["kwargs"])
+                    kwargs.update({param: results[dep] for param, dep in task["deps"].items()})
+                    logging.info(f"Iniciando tarefa '{name}'")
+                    if collect_metrics:
+                        # Em outro processo as medições ficam no filho: a tarefa as devolve junto com o resultado
+                        future = executor.submit(metrics.run_and_collect, task["func"], **kwargs)
+                    else:
+                        future = executor.submit(task["func"], **kwargs)
+                    running[future] = (name, time.perf_counter())
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Dependências circulares ou inexistentes no DAG: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, started = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    if collect_metrics:
+                        results[name], child_records = results[name]
+                        metrics.extend(child_records)
+                except Exception as e:
+                    logging.error(f"Tarefa '{name}' falhou: {e}")
+                    for other in running:
+                        other.cancel()
+                    raise
+                rows = f" com {len(results[name])} registros" if isinstance(results[name], pd.DataFrame) else ""
+                logging.info(f"Tarefa '{name}' finalizada em {time.perf_counter() - started:.2f}s{rows}")
+    return results
+
+def main(stream: bool | None = None, full_refresh: bool | None = None,
+         from_staging: bool = False) -> pd.DataFrame:
     """
     Função principal que executa o pipeline ETL completo:
     1. Extrai, transforma e limpa dados de carts, products e users.
     2. Carrega os dados tratados no PostgreSQL.
     3. Retorna os DataFrames resultantes para validação ou testes.
+
+    As extrações e transformações independentes rodam em paralelo (ver
+    run_dag); a carga só começa quando as três entidades estão prontas.
+    Com stream=True (ou ETL_STREAM_CARTS=true) os carts são processados em
+    lotes de ETL_CHUNK_SIZE documentos e não são retornados.
+    Por padrão só são extraídos documentos novos desde a última carga;
+    full_refresh=True (ou ETL_FULL_REFRESH=true) reprocessa tudo.
+    Com ETL_STAGING_DIR, as entidades transformadas são gravadas em Parquet
+    antes da carga; from_staging=True executa apenas a carga a partir delas.
     """
     logging.info("Iniciando pipeline ETL completo")
+    if stream is None:
+        stream = os.getenv("ETL_STREAM_CARTS", "false").lower() == "true"
+    if full_refresh is None:
+        full_refresh = os.getenv("ETL_FULL_REFRESH", "false").lower() == "true"
 
+    invalidate_cache()  # Cache de extração vale apenas para esta execução
+    metrics.reset()     # Medições por etapa (ETL_METRICS) valem apenas para esta execução
+    status = "error"
     try:
-        # ETL de carts (extração e transformação)
-        logging.info("Executando ETL de carts...")
-        data_carts = run_etl_carts()  # Chama função que retorna DataFrame limpo de carrinhos
-        logging.info(f"ETL de carts finalizado com {len(data_carts)} registros válidos")
-
-        # ETL de products (extração e transformação)
-        logging.info("Executando ETL de products...")
-        data_products = run_etl_products()  # Chama função que retorna DataFrame limpo de produtos
-        logging.info(f"ETL de products finalizado com {len(data_products)} registros válidos")
-
-        # ETL de users (extração e transformação)
-        logging.info("Executando ETL de users...")
-        data_users = run_etl_users()  # Chama função que retorna DataFrame limpo de usuários
-        logging.info(f"ETL de users finalizado com {len(data_users)} registros válidos")
-
-        # Carga dos dados transformados no PostgreSQL
+        if from_staging:
+            result = run_from_staging()
+            status = "ok"
+            return result
+
+        queries, watermarks, incremental = plan_extraction(full_refresh)
+
+        if stream:
+            result = run_streaming(queries, watermarks, incremental)
+            status = "ok"
+            return result
+
+        # ETL de carts, products e users (extração e transformação em paralelo)
+        results = run_dag(build_etl_tasks(queries))
+        data_carts, data_products, data_users = results['carts'], results['products'], results['users']
+
+        if staging.STAGING_DIR:
+            # Entidades transformadas em Parquet: uma falha na carga pode ser refeita com --from-staging
+            staging.write_staging(data_carts, data_products, data_users, watermarks, incremental)
+
+        # Carga dos dados transformados no PostgreSQL (dimensões antes da fact_sales)
         logging.info("Iniciando carga dos dados no PostgreSQL...")
-        run_load(data_carts, data_products, data_users)  # Chama função de carga ETL
+        run_load(data_carts, data_products, data_users, watermarks, incremental)  # Chama função de carga ETL
         logging.info("Carga concluída com sucesso")
 
-        executar_views(connect_db())
+        with pg_connection() as conn:
+            executar_views(conn)
 
         logging.info("Pipeline ETL completo finalizado")
+        status = "ok"
         return data_carts, data_products, data_users  # Retorna DataFrames para validação/testes
 
     except Exception as e:
         logging.error(f"Pipeline ETL falhou: {e}")  # Log de erro em caso de falha
         raise  # Propaga exceção para tratamento externo ou debug
+    finally:
+        metrics.write_report(status)  # Relatório JSON (e Prometheus) da execução, se ETL_METRICS=true
+        invalidate_cache()  # Libera memória (e arquivos Parquet) do cache de extração
+        close_connections()  # Encerra o cliente do MongoDB e o pool do PostgreSQL
+
+def run_from_staging():
+    """
+    Executa apenas a carga e as views a partir do staging em Parquet
+    (ETL_STAGING_DIR) gravado por uma execução anterior.
+    """
+    if not staging.STAGING_DIR:
+        raise ValueError("ETL_STAGING_DIR não configurado: não há staging para carregar")
+    logging.info(f"Iniciando carga a partir do staging em '{staging.STAGING_DIR}'...")
+    run_load_staged()
+    logging.info("Carga concluída com sucesso")
+
+    with pg_connection() as conn:
+        executar_views(conn)
+
+    logging.info("Pipeline ETL (somente carga) finalizado")
+    return None
+
+def run_streaming(queries: dict, watermarks: dict, incremental: bool):
+    """
+    Executa o pipeline com carts em streaming: products e users são tratados
+    por completo (em paralelo), e os carts fluem em lotes da extração até a fact_sales.
+    """
+    chunk_size = int(os.getenv("ETL_CHUNK_SIZE", "10000"))
+    if staging.STAGING_DIR:
+        logging.warning("Staging em Parquet não é gravado no modo streaming (carts são carregados lote a lote)")
+
+    tasks = build_etl_tasks(queries)
+    del tasks['carts']
+    results = run_dag(tasks)
+    data_products, data_users = results['products'], results['users']
+
+    # Carts são extraídos, transformados e carregados lote a lote
+    logging.info(f"Executando ETL de carts em streaming (lotes de {chunk_size} registros)...")
+    carts_chunks = iter_etl_carts(chunk_size, queries['carts'], results['products_raw'])
+    run_load_stream(carts_chunks, data_products, data_users, watermarks, incremental)
+    logging.info("Carga concluída com sucesso")
+
+    with pg_connection() as conn:
+        executar_views(conn)
+
+    logging.info("Pipeline ETL completo finalizado")
+    return None, data_products, data_users
 
 def fetch_view(view_name: str, cursor) -> pd.DataFrame:
     """
@@ -62,7 +244,6 @@ def fetch_view(view_name: str, cursor) -> pd.DataFrame:
     return pd.DataFrame(rows, columns=colnames)
 
 def executar_views(conn):
-    cursor = conn.cursor()
     view_names = [
         "vw_revenue_by_location",
         "vw_top_selling_product",
@@ -70,11 +251,20 @@ def executar_views(conn):
         "vw_rating_sales",
         "vw_top_selling_months"
     ]
-    for view in view_names:
-        print(f"\n===== {view} =====")
-        df = fetch_view(view, cursor)
-        print(df)
+    with conn.cursor() as cursor:
+        for view in view_names:
+            print(f"\n===== {view} =====")
+            df = fetch_view(view, cursor)
+            print(df)
 
 # Permite execução direta do script
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Pipeline ETL MongoDB -> PostgreSQL")
+    parser.add_argument("--full-refresh", action="store_true", default=None,
+                        help="Ignora as marcas d'água e reprocessa todas as coleções (backfill)")
+    parser.add_argument("--stream", action="store_true", default=None,
+                        help="Processa os carts em lotes (ETL_CHUNK_SIZE)")
+    parser.add_argument("--from-staging", action="store_true",
+                        help="Executa apenas a carga a partir do staging em Parquet (ETL_STAGING_DIR)")
+    args = parser.parse_args()
+    main(stream=args.stream, full_refresh=args.full_refresh, from_staging=args.from_staging)
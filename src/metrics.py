@@ -0,0 +1,192 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv        # Para carregar variáveis de ambiente de um arquivo .env
+import pandas as pd
+
+try:
+    import resource                   # Pico de RSS do processo (indisponível no Windows)
+except ImportError:
+    resource = None
+
+# Carrega as variáveis do arquivo .env para uso no código
+load_dotenv()
+
+# Instrumentação das etapas do pipeline (desativada por padrão)
+ENABLED = os.getenv("ETL_METRICS", "false").lower() == "true"
+REPORT_PATH = os.getenv("ETL_METRICS_REPORT", "metrics/run_report.json")
+PROMETHEUS_PATH = os.getenv("ETL_METRICS_PROMETHEUS")   # Arquivo .prom para o textfile collector (opcional)
+
+# Medições da execução atual (uma por chamada de etapa)
+_records = []
+_lock = threading.Lock()
+_run_started = time.time()
+
+# Primeiro DataFrame entre os argumentos de uma etapa (entrada medida)
+def first_dataframe(args, kwargs):
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return value
+    return None
+
+# Memória ocupada pelo DataFrame em bytes (inclui o conteúdo de colunas de objetos)
+def dataframe_memory(df) -> int | None:
+    if not isinstance(df, pd.DataFrame):
+        return None
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+# Pico de memória residente do processo em bytes
+def peak_rss() -> int | None:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # ru_maxrss é em KB no Linux
+
+def instrument(func=None, *, stage: str | None = None):
+    """
+    Decorador que mede uma etapa do pipeline: tempo de parede, tempo de CPU
+    da thread, linhas e memória do DataFrame de entrada e de saída e pico de
+    RSS do processo. Com ETL_METRICS desativado a etapa é chamada diretamente.
+    """
+    if func is None:
+        return functools.partial(instrument, stage=stage)
+    name = stage or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+
+        data_in = first_dataframe(args, kwargs)
+        started_at = time.time()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        status, result = "error", None
+        try:
+            result = func(*args, **kwargs)
+            status = "ok"
+            return result
+        finally:
+            record = {
+                "stage": name,
+                "status": status,
+                "started_at": datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+                "wall_seconds": round(time.perf_counter() - wall_start, 6),
+                "cpu_seconds": round(time.thread_time() - cpu_start, 6),
+                "rows_in": len(data_in) if data_in is not None else None,
+                "rows_out": len(result) if isinstance(result, pd.DataFrame) else None,
+                "memory_in_bytes": dataframe_memory(data_in),
+                "memory_out_bytes": dataframe_memory(result),
+                "peak_rss_bytes": peak_rss(),
+                "pid": os.getpid(),
+            }
+            with _lock:
+                _records.append(record)
+    return wrapper
+
+# Medições registradas até agora
+def records() -> list:
+    with _lock:
+        return list(_records)
+
+# Incorpora medições feitas em outro processo (ETL_EXECUTOR=process)
+def extend(new_records: list):
+    with _lock:
+        _records.extend(new_records)
+
+# Reinicia as medições (início de uma execução)
+def reset():
+    global _run_started
+    with _lock:
+        _records.clear()
+        _run_started = time.time()
+
+# Executa uma tarefa e devolve também as medições feitas nela (usado em processos filhos)
+def run_and_collect(func, **kwargs):
+    with _lock:
+        start = len(_records)
+    result = func(**kwargs)
+    with _lock:
+        collected = _records[start:]
+    return result, collected
+
+# Agrega as medições por etapa (etapas executadas em lotes aparecem uma vez)
+def summarize(stage_records: list) -> dict:
+    summary = {}
+    for record in stage_records:
+        stage = summary.setdefault(record["stage"], {
+            "calls": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+            "rows_in": 0, "rows_out": 0, "max_memory_out_bytes": 0, "peak_rss_bytes": 0
+        })
+        stage["calls"] += 1
+        stage["errors"] += record["status"] != "ok"
+        stage["wall_seconds"] = round(stage["wall_seconds"] + record["wall_seconds"], 6)
+        stage["cpu_seconds"] = round(stage["cpu_seconds"] + record["cpu_seconds"], 6)
+        stage["rows_in"] += record["rows_in"] or 0
+        stage["rows_out"] += record["rows_out"] or 0
+        stage["max_memory_out_bytes"] = max(stage["max_memory_out_bytes"], record["memory_out_bytes"] or 0)
+        stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], record["peak_rss_bytes"] or 0)
+    return summary
+
+# Grava o relatório JSON da execução (e o arquivo Prometheus, se configurado)
+def write_report(status: str, path: str | None = None, prometheus_path: str | None = None) -> dict | None:
+    if not ENABLED:
+        return None
+    stage_records = records()
+    report = {
+        "run_started": datetime.fromtimestamp(_run_started, timezone.utc).isoformat(),
+        "run_finished": datetime.now(timezone.utc).isoformat(),
+        "status": status,
+        "wall_seconds": round(time.time() - _run_started, 3),
+        "peak_rss_bytes": peak_rss(),
+        "summary": summarize(stage_records),
+        "stages": stage_records,
+    }
+    path = path or REPORT_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logging.info(f"Relatório de métricas gravado em {path}")
+
+    prometheus_path = prometheus_path or PROMETHEUS_PATH
+    if prometheus_path:
+        write_prometheus(report, prometheus_path)
+    return report
+
+# Escreve as métricas no formato de texto do Prometheus/OpenMetrics (textfile collector do node_exporter)
+def write_prometheus(report: dict, path: str):
+    metrics = [
+        ("etl_stage_wall_seconds", "Tempo de parede acumulado por etapa", "wall_seconds"),
+        ("etl_stage_cpu_seconds", "Tempo de CPU acumulado por etapa", "cpu_seconds"),
+        ("etl_stage_rows_in", "Linhas recebidas por etapa", "rows_in"),
+        ("etl_stage_rows_out", "Linhas devolvidas por etapa", "rows_out"),
+        ("etl_stage_calls", "Chamadas de cada etapa", "calls"),
+        ("etl_stage_errors", "Chamadas de cada etapa que falharam", "errors"),
+        ("etl_stage_memory_out_bytes", "Maior DataFrame devolvido por etapa", "max_memory_out_bytes"),
+    ]
+    lines = []
+    for metric, help_text, key in metrics:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for stage, values in report["summary"].items():
+            lines.append(f'{metric}{{stage="{stage}"}} {values[key]}')
+    lines += [
+        "# HELP etl_run_wall_seconds Duração total da execução",
+        "# TYPE etl_run_wall_seconds gauge",
+        f"etl_run_wall_seconds {report['wall_seconds']}",
+        "# HELP etl_run_success Execução concluída com sucesso (1) ou com falha (0)",
+        "# TYPE etl_run_success gauge",
+        f"etl_run_success {int(report['status'] == 'ok')}",
+        "# HELP etl_peak_rss_bytes Pico de memória residente do processo principal",
+        "# TYPE etl_peak_rss_bytes gauge",
+        f"etl_peak_rss_bytes {report['peak_rss_bytes'] or 0}",
+        "# EOF",
+    ]
+    # Escrita atômica: o coletor nunca lê um arquivo pela metade
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+    logging.info(f"Métricas no formato Prometheus gravadas em {path}")
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Campos de cada item do carrinho -> coluna no DataFrame de itens
+LINE_ITEM_FIELDS = {'id': 'product_id', 'price': 'price', 'quantity': 'quantity'}
+
+# Itens via pyarrow: a lista de dicts é convertida em C para list<struct> e achatada sem criar objetos por item.
+# Devolve None se a coluna não tiver esse formato (tipos mistos, valores que não são listas de dicts etc.)
+def arrow_line_items(products: np.ndarray) -> tuple | None:
+    try:
+        items = pa.array(products, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return None
+    if not (pa.types.is_list(items.type) and pa.types.is_struct(items.type.value_type)):
+        return None
+    positions = pc.list_parent_indices(items)
+    flat = items.flatten()
+    valid = flat.is_valid()                    # Itens nulos dentro da lista são ignorados
+    positions, flat = positions.filter(valid), flat.filter(valid)
+    names = {flat.type.field(i).name for i in range(flat.type.num_fields)}
+    columns = {
+        column: flat.field(key).to_pandas() if key in names else pd.Series(np.nan, index=range(len(flat)))
+        for key, column in LINE_ITEM_FIELDS.items()
+    }
+    return positions.to_numpy(), columns
+
+# Itens registro a registro (caminho geral, mesmos resultados do pyarrow)
+def python_line_items(products: np.ndarray) -> tuple:
+    positions, values = [], {key: [] for key in LINE_ITEM_FIELDS}
+    for position, items in enumerate(products):
+        if isinstance(items, dict):
+            items = [items]
+        elif not isinstance(items, (list, tuple, np.ndarray)):
+            continue                           # Carrinho sem lista de produtos
+        for item in items:
+            if isinstance(item, dict):
+                positions.append(position)
+                for key, column in values.items():
+                    column.append(item.get(key, np.nan))
+    columns = {LINE_ITEM_FIELDS[key]: pd.Series(column, dtype=None if column else float)
+               for key, column in values.items()}
+    return np.asarray(positions, dtype=np.int64), columns
+
+def flatten_line_items(data_carts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Achata os itens dos carrinhos (coluna products) em um DataFrame com uma
+    linha por item: cart_index (rótulo do carrinho em data_carts),
+    product_id, price e quantity. Campos ausentes viram NaN; carrinhos sem
+    itens e itens que não são dicts não geram linhas.
+    """
+    products = data_carts['products'].to_numpy(dtype=object)
+    flattened = arrow_line_items(products)
+    positions, columns = flattened if flattened is not None else python_line_items(products)
+    line_items = pd.DataFrame({'cart_index': data_carts.index.take(positions)})
+    for column, values in columns.items():
+        line_items[column] = values.to_numpy()
+    return line_items
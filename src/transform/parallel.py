@@ -0,0 +1,91 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .. import metrics
+
+# Configuração global de logs
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Processos usados nas transformações em lotes (1 = transformação serial, sem processos extras)
+TRANSFORM_WORKERS = int(os.getenv("ETL_TRANSFORM_WORKERS", "1"))
+# Mínimo de registros por lote: abaixo disso o custo de iniciar processos e serializar os lotes não compensa
+MIN_CHUNK_ROWS = int(os.getenv("ETL_TRANSFORM_MIN_CHUNK_ROWS", "50000"))
+
+# Número de lotes para um DataFrame de `rows` registros (1 = executar em série)
+def chunk_count(rows: int, workers: int | None = None) -> int:
+    workers = workers or TRANSFORM_WORKERS
+    return max(1, min(workers, math.ceil(rows / MIN_CHUNK_ROWS)))
+
+# Indica se a transformação de `rows` registros deve ser feita em lotes paralelos
+def use_parallel(rows: int, workers: int | None = None) -> bool:
+    return chunk_count(rows, workers) > 1
+
+# Divide o DataFrame em lotes contíguos de linhas (os rótulos do índice são mantidos)
+def split_chunks(data: pd.DataFrame, chunks: int) -> list:
+    bounds = np.linspace(0, len(data), chunks + 1).astype(int)
+    return [data.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+# Executa, em um processo do pool, as etapas por lote em sequência sobre um lote
+def run_chunk(data: pd.DataFrame, funcs: list) -> pd.DataFrame:
+    for func in funcs:
+        data = func(data)
+    return data
+
+# Concatena os lotes transformados na ordem original (lotes vazios não influenciam os tipos)
+def concat_chunks(chunks: list) -> pd.DataFrame:
+    filled = [chunk for chunk in chunks if not chunk.empty]
+    if not filled:
+        return chunks[0]
+    return filled[0] if len(filled) == 1 else pd.concat(filled)
+
+# Aplica as etapas por lote em paralelo no pool e junta o resultado
+def map_chunks(executor, data: pd.DataFrame, funcs: list, chunks: int) -> pd.DataFrame:
+    if metrics.ENABLED:
+        # As medições feitas nos processos do pool voltam junto com cada lote
+        futures = [executor.submit(metrics.run_and_collect, run_chunk, data=chunk, funcs=funcs)
+                   for chunk in split_chunks(data, chunks)]
+        results = []
+        for future in futures:
+            result, child_records = future.result()
+            metrics.extend(child_records)
+            results.append(result)
+    else:
+        results = list(executor.map(run_chunk, split_chunks(data, chunks), itertools.repeat(funcs)))
+    return concat_chunks(results)
+
+def run_stages(data: pd.DataFrame, stages: list, workers: int | None = None) -> pd.DataFrame:
+    """
+    Executa uma sequência de etapas de transformação dividindo o DataFrame
+    em lotes de linhas processados em um ProcessPoolExecutor.
+
+    Cada etapa é um par (função, escopo): 'chunk' para etapas que avaliam
+    cada registro isoladamente (executadas em cada lote, etapas seguidas
+    em uma única tarefa por lote) e 'global' para etapas que comparam
+    registros entre si, como a remoção de duplicados (executadas uma vez
+    no processo atual, sobre os lotes já concatenados). As funções devem
+    ser definidas no nível do módulo (são serializadas para os processos).
+    Os lotes são concatenados na ordem original, com o índice preservado,
+    produzindo o mesmo resultado da execução serial das etapas.
+    """
+    chunks = chunk_count(len(data), workers)
+    if chunks == 1:
+        return run_chunk(data, [func for func, _ in stages])
+
+    logging.info(f"Transformando {len(data)} registros em {chunks} lotes paralelos")
+    # Processos com 'spawn' não herdam conexões nem locks das threads do pipeline
+    with ProcessPoolExecutor(max_workers=chunks, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for per_chunk, group in itertools.groupby(stages, key=lambda stage: stage[1] == 'chunk'):
+            funcs = [func for func, _ in group]
+            if per_chunk:
+                data = map_chunks(executor, data, funcs, chunks)
+            else:
+                data = run_chunk(data, funcs)
+    return data
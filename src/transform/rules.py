@@ -0,0 +1,111 @@
+import functools
+import logging
+import numpy as np
+import pandas as pd
+
+# Configuração global de logs
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Operações de coluna reutilizáveis entre regras: nome -> (operação de origem, função)
+# Ex.: 'strip_lower' parte do resultado de 'strip', que é calculado uma única vez por coluna
+COLUMN_OPS = {
+    'strip': (None, lambda s: s.str.strip()),
+    'strip_lower': ('strip', lambda s: s.str.lower()),
+    'strip_capitalize': ('strip', lambda s: s.str.capitalize()),
+    'len': (None, lambda s: s.str.len()),
+    'as_str_strip': (None, lambda s: s.astype(str).str.strip()),
+    'ymd_date': ('strip', lambda s: pd.to_datetime(s, format='%Y-%m-%d', errors='coerce')),  # Inválidas viram NaT
+}
+
+# Retorna a coluna (ou uma operação sobre ela) apenas para os registros ainda válidos.
+# Cada combinação coluna/operação é calculada uma só vez, sobre os registros válidos naquele momento;
+# como o conjunto de válidos só diminui, os usos seguintes apenas recortam o resultado guardado.
+# Com `filtered` (DataFrame já restrito aos válidos), colunas ainda não usadas são lidas dele sem novo recorte
+def column_values(cache: dict, data: pd.DataFrame, valid: np.ndarray, column: str, op: str | None = None,
+                  filtered: pd.DataFrame | None = None) -> pd.Series:
+    key = (column, op)
+    if key not in cache:
+        if op is None:
+            if filtered is not None:
+                values = filtered[column]
+            else:
+                values = data[column] if valid.all() else data[column].take(np.flatnonzero(valid))
+        else:
+            source, func = COLUMN_OPS[op]
+            values = func(column_values(cache, data, valid, column, source, filtered))
+        cache[key] = (valid.copy(), values)
+    computed_for, values = cache[key]
+    if np.count_nonzero(valid) == len(values):
+        return values                          # Nenhum registro removido desde o cálculo
+    return values.take(np.flatnonzero(valid[computed_for]))
+
+# Quando menos que esta fração dos registros continua válida, o DataFrame de trabalho é compactado
+# (evita recortar cada coluna a partir do DataFrame original, ex.: após remover muitos duplicados)
+COMPACT_THRESHOLD = 0.5
+
+# Restringe o DataFrame de trabalho aos registros válidos; os valores guardados são descartados,
+# pois passam a ser lidos do DataFrame compactado sem novo recorte
+def compact(cache: dict, data: pd.DataFrame, valid: np.ndarray) -> tuple:
+    cache.clear()
+    data = data.take(np.flatnonzero(valid))
+    return data, np.ones(len(data), dtype=bool)
+
+# Converte a máscara de uma regra em array booleano (valores ausentes contam como inválidos)
+def mask_values(mask) -> np.ndarray:
+    if isinstance(mask, pd.Series):
+        return mask.fillna(False).to_numpy(dtype=bool)
+    return np.asarray(mask, dtype=bool)
+
+def apply_rules(data: pd.DataFrame, rules: list) -> pd.DataFrame:
+    """
+    Aplica uma lista de regras em uma única passada sobre o DataFrame.
+
+    Cada regra é um dict com:
+      - description: mensagem registrada no log ao avaliar a regra
+      - reason: motivo usado na contagem de registros removidos
+      - keep: função col -> máscara booleana dos registros válidos, ou
+      - unique: colunas que não podem se repetir (mantém a primeira ocorrência
+        entre os registros ainda válidos)
+      - normalize: dict coluna -> função col -> valores padronizados
+
+    As máscaras são avaliadas na ordem das regras, sobre os valores
+    originais e apenas para os registros aprovados pelas regras anteriores
+    (`col(coluna, op)` devolve esses registros e reaproveita operações já
+    calculadas, ver COLUMN_OPS). Os registros inválidos são removidos uma
+    única vez no final e só então as normalizações são aplicadas (se uma
+    regra deixar menos de COMPACT_THRESHOLD dos registros, o DataFrame de
+    trabalho é compactado antes das regras seguintes).
+    Normalizações de colunas ausentes no DataFrame são ignoradas.
+    """
+    cache = {}
+    valid = np.ones(len(data), dtype=bool)    # Atualizado no lugar: col() sempre enxerga os válidos atuais
+    col = functools.partial(column_values, cache, data, valid)
+    for rule in rules:
+        logging.info(rule['description'])
+        if 'unique' in rule:
+            # Duplicados são avaliados apenas entre os registros que ainda são válidos
+            keep = ~data[rule['unique']][valid].duplicated(keep='first').to_numpy()
+        elif 'keep' in rule:
+            keep = mask_values(rule['keep'](col))
+        else:
+            continue
+        rows = np.flatnonzero(valid)
+        removed = int(np.count_nonzero(~keep))
+        valid[rows[~keep]] = False
+        if removed > 0:
+            logging.warning(f"{removed} registros removidos por {rule['reason']}")
+        if np.count_nonzero(valid) < COMPACT_THRESHOLD * len(valid):
+            data, valid = compact(cache, data, valid)
+            col = functools.partial(column_values, cache, data, valid)
+
+    result = data[valid]                       # Cópia final (única, salvo compactação)
+    col = functools.partial(column_values, cache, data, valid, filtered=result)
+    for rule in rules:
+        for column, normalize in rule.get('normalize', {}).items():
+            if column in data.columns:
+                result[column] = normalize(col).set_axis(result.index)
+    logging.info(f"Registros restantes: {len(result)}")
+    return result
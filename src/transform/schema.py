@@ -0,0 +1,83 @@
+import logging
+import numpy as np
+import pandas as pd
+from ..metrics import instrument
+
+# Configuração global de logs
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Colunas largas (listas, textos longos) que o ETL não usa; descartadas logo após a extração
+WIDE_COLUMNS = ['image', 'userAgent', 'reviews', 'images']
+
+# Tipos aplicados ao final de cada transformação:
+#   - 'category': poucos valores distintos repetidos em muitos registros
+#   - 'string': texto livre em string[pyarrow] (colunas object apenas com textos)
+#   - 'integer': inteiro no menor tipo que comporta os valores (ids são mantidos em int64, pois são chaves de merge)
+USERS_SCHEMA = {
+    'gender': 'category', 'bloodGroup': 'category', 'eyeColor': 'category', 'role': 'category',
+    'university': 'category', 'city': 'category', 'state': 'category', 'country': 'category',
+    'firstName': 'string', 'lastName': 'string', 'maidenName': 'string', 'email': 'string',
+    'phone': 'string', 'username': 'string', 'password': 'string',
+    'age': 'integer',
+}
+PRODUCTS_SCHEMA = {
+    'category': 'category', 'brand': 'category', 'availabilityStatus': 'category',
+    'warrantyInformation': 'category', 'shippingInformation': 'category', 'returnPolicy': 'category',
+    'title': 'string', 'description': 'string', 'sku': 'string', 'thumbnail': 'string',
+    'stock': 'integer', 'minimumOrderQuantity': 'integer',
+}
+CARTS_SCHEMA = {
+    'totalProducts': 'integer', 'totalQuantity': 'integer',
+    'quantity': 'integer',                     # Carts achatados em itens (ETL_CARTS_PUSHDOWN)
+}
+
+# Remove as colunas largas presentes no DataFrame (ex.: extrações sem projeção)
+def drop_wide_columns(data: pd.DataFrame) -> pd.DataFrame:
+    columns = [col for col in WIDE_COLUMNS if col in data.columns]
+    if not columns:
+        return data
+    logging.info(f"Descartando colunas não utilizadas: {columns}")
+    return data.drop(columns=columns)
+
+# Converte uma coluna inteira (ou float só com inteiros, sem ausentes) para o menor tipo inteiro
+def downcast_integer(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_float_dtype(values):
+        if values.isna().any() or not (values % 1 == 0).all():
+            return values                      # Ausentes ou frações: mantém float
+        values = values.astype('int64')
+    if not pd.api.types.is_integer_dtype(values):
+        return values
+    return pd.to_numeric(values, downcast='integer')
+
+# Converte para string[pyarrow] apenas colunas que contêm somente textos (ou ausentes)
+def to_string(values: pd.Series) -> pd.Series:
+    if isinstance(values.dtype, pd.StringDtype):
+        return values
+    if values.dtype != object or pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty'):
+        return values
+    return values.astype(pd.StringDtype("pyarrow", na_value=np.nan))   # Mesmo tipo 'str' do pandas 3
+
+CONVERTERS = {
+    'category': lambda values: values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category'),
+    'string': to_string,
+    'integer': downcast_integer,
+}
+
+@instrument
+def apply_schema(data: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """
+    Aplica os tipos do schema (coluna -> 'category', 'string' ou 'integer')
+    às colunas presentes no DataFrame, reduzindo a memória por registro.
+    Os valores não mudam: conversões que alterariam algum valor (ex.: float
+    com frações para inteiro) são ignoradas.
+    """
+    if data.empty:
+        return data
+    data = data.copy(deep=False)
+    for column, kind in schema.items():
+        if column in data.columns:
+            data[column] = CONVERTERS[kind](data[column])
+    return data
@@ -1,7 +1,15 @@
+import functools
 import logging
+import os
+import numpy as np
 import pandas as pd
 # Importa função de extração da coleção MongoDB
-from ..extract.extract import extract_collection
+from ..extract.extract import extract_collection, iter_collection, extract_cart_line_items, iter_cart_line_items
+from .transform_products import PRODUCTS_FIELDS
+from ..metrics import instrument
+from .schema import CARTS_SCHEMA, apply_schema, drop_wide_columns
+from .line_items import flatten_line_items
+from .parallel import run_stages
 
 # Configuração global de logs para o ETL de carts
 logging.basicConfig(
@@ -9,7 +17,12 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Campos de carts usados pelo ETL (projeção aplicada no MongoDB)
+CARTS_FIELDS = ['id', 'userId', 'products.id', 'products.price', 'products.quantity',
+                'total', 'discountedTotal', 'totalProducts', 'totalQuantity', 'transaction_date']
+
 # Função para remover registros com valores ausentes críticos
+@instrument
 def drop_missing_values(data_carts: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros com valores ausentes (userId, products, total, discountedTotal)")
     before = len(data_carts)
@@ -22,6 +35,7 @@ def drop_missing_values(data_carts: pd.DataFrame) -> pd.DataFrame:
     return data_carts
 
 # Função para remover registros com valores inconsistentes
+@instrument
 def drop_inconsistent_values(data_carts: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros com valores inconsistentes (total, totalProducts, totalQuantity negativos)")
     before = len(data_carts)
@@ -53,11 +67,62 @@ def parse_date(date) -> pd.Timestamp:
         logging.warning(f"Falha ao converter data: {date} | Erro: {e}")
         return pd.NaT
 
+# Limite de segundos UNIX representável em datetime64[ns] (fora dele usa parse_date)
+UNIX_SECONDS_LIMIT = 9_200_000_000
+
+# Versão vetorizada de parse_date: classifica a coluna em formatos e converte cada grupo de uma vez
+def parse_dates(dates: pd.Series) -> pd.Series:
+    values = dates.to_numpy(dtype=object)
+    types = dates.map(type).to_numpy()
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    pending = np.ones(len(values), dtype=bool)      # Registros ainda não convertidos
+
+    # Timestamps UNIX (inteiros)
+    is_int = types == int
+    if is_int.any():
+        try:
+            seconds = values[is_int].astype('int64')
+            in_range = np.abs(seconds) < UNIX_SECONDS_LIMIT
+            positions = np.flatnonzero(is_int)[in_range]
+            result[positions] = pd.to_datetime(seconds[in_range], unit='s').to_numpy(dtype='datetime64[ns]')
+            pending[positions] = False
+        except OverflowError:
+            pass                                    # Inteiros gigantes ficam para o caminho linha a linha
+
+    # Strings: normaliza ISO ('T' e 'Z') e separa YYYY-MM-DD HH:MM:SS de DD/MM/YYYY
+    is_str = types == str
+    if is_str.any():
+        texts = pd.Series(values[is_str], dtype=str).str.replace('T', ' ', regex=False).str.replace('Z', '', regex=False)
+        has_dash = texts.str.contains('-', regex=False).to_numpy(dtype=bool)
+        has_slash = ~has_dash & texts.str.contains('/', regex=False).to_numpy(dtype=bool)
+        str_positions = np.flatnonzero(is_str)
+        for mask, date_format in [(has_dash, '%Y-%m-%d %H:%M:%S'), (has_slash, '%d/%m/%Y')]:
+            if not mask.any():
+                continue
+            parsed = pd.to_datetime(texts[mask], format=date_format, errors='coerce').to_numpy(dtype='datetime64[ns]')
+            ok = ~np.isnat(parsed)
+            positions = str_positions[mask][ok]
+            result[positions] = parsed[ok]
+            pending[positions] = False
+
+    result = pd.Series(result, index=dates.index)
+    # Demais valores (outros formatos, tipos inesperados ou inválidos) seguem o caminho linha a linha,
+    # garantindo o mesmo resultado de parse_date, inclusive NaT para entradas inválidas
+    if pending.any():
+        fallback = dates[pending].map(parse_date).to_numpy(dtype=object)
+        try:
+            result[pending] = fallback
+        except (TypeError, ValueError):
+            result = result.astype(object)          # Ex.: datas com fuso horário
+            result[pending] = fallback
+    return result
+
 # Função para transformar a coluna de datas das transações
+@instrument
 def transform_transaction_date(data_carts: pd.DataFrame) -> pd.DataFrame:
     logging.info("Transformando coluna transaction_date")
-    # Aplica função de parse para cada registro
-    data_carts['transaction_date'] = data_carts['transaction_date'].apply(parse_date)
+    # Converte a coluna inteira de forma vetorizada
+    data_carts['transaction_date'] = parse_dates(data_carts['transaction_date'])
     before = len(data_carts)
     # Remove registros com datas inválidas
     data_carts = data_carts.dropna(subset=['transaction_date'])
@@ -69,57 +134,207 @@ def transform_transaction_date(data_carts: pd.DataFrame) -> pd.DataFrame:
     logging.info(f"Transaction_date transformada com sucesso. Total registros válidos: {len(data_carts)}")
     return data_carts
 
-# Função para remover pedidos que não atendem à quantidade mínima
-def remove_invalid_orders(data_carts: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Removendo pedidos com quantidade de produtos abaixo do mínimo")
-    data_products = extract_collection('products')  # Extrai dados de produtos
-    before = len(data_carts)
-
-    # Explode lista de produtos em linhas individuais, mantendo índice do carrinho
-    carts_exploded = data_carts.explode('products').reset_index().rename(columns={'index': 'cart_index'})
+# Tamanho máximo do índice denso de quantidades mínimas: até MINIMUM_INDEX_SPARSITY posições por produto
+# (ou MINIMUM_INDEX_MIN_SIZE); produtos com ids maiores são comparados pelo caminho geral (merge)
+MINIMUM_INDEX_SPARSITY = 8
+MINIMUM_INDEX_MIN_SIZE = 1 << 16
 
-    # Normaliza dict de produtos em colunas
-    products = pd.json_normalize(carts_exploded['products'])
-    products['cart_index'] = carts_exploded['cart_index'].values
+# Coluna numérica (inteiros ou floats, sem booleanos) em que os ids podem ser usados como posições
+def is_number(values: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
 
-    # Obtém quantidade mínima de cada produto
-    products_minimum = data_products[['id', 'minimumOrderQuantity']].rename(columns={'id': 'product_id'})
+# Ids como posições do índice denso: apenas inteiros não negativos (ausentes, negativos e frações ficam de fora)
+def integer_ids(ids: pd.Series) -> tuple:
+    numbers = ids.to_numpy(dtype='float64', na_value=np.nan)
+    with np.errstate(invalid='ignore'):        # inf % 1 é NaN (descartado pelo isfinite)
+        dense = np.isfinite(numbers) & (numbers >= 0) & (numbers % 1 == 0) & (numbers < 2 ** 53)
+    return np.where(dense, numbers, 0).astype('int64'), dense
 
-    # Seleciona colunas relevantes do carrinho
-    products_cart = products[['cart_index', 'id', 'quantity']].rename(columns={'id': 'product_id'})
+def build_minimum_index(data_products: pd.DataFrame) -> dict:
+    """
+    Índice da quantidade mínima de cada produto para remove_invalid_orders,
+    montado uma vez e reutilizado em todos os lotes de carts: array denso
+    em que a posição é o id do produto (NaN para posições sem produto ou
+    sem quantidade mínima). Com ids repetidos vale a maior quantidade
+    mínima, pois um item abaixo de qualquer uma delas invalida o carrinho.
+    Produtos com ids que não cabem no índice (ausentes, negativos,
+    fracionários, muito grandes ou não numéricos) ficam em 'others' e são
+    comparados por merge, como antes.
+    """
+    products = data_products[['id', 'minimumOrderQuantity']].rename(columns={'id': 'product_id'})
+    if not (is_number(products['product_id']) and is_number(products['minimumOrderQuantity'])):
+        return {'minimums': None, 'others': products, 'products': products}
+    ids, dense = integer_ids(products['product_id'])
+    limit = max(MINIMUM_INDEX_SPARSITY * len(products), MINIMUM_INDEX_MIN_SIZE)
+    size = min(int(ids[dense].max()) + 1, limit) if dense.any() else 0
+    dense &= ids < size
+    minimums = np.full(size, np.nan)
+    np.fmax.at(minimums, ids[dense], products['minimumOrderQuantity'].to_numpy(dtype='float64', na_value=np.nan)[dense])
+    return {'minimums': minimums, 'others': products[~dense], 'products': products}
 
-    # Validação: merge produtos do carrinho com quantidade mínima
+# Caminho geral: merge dos itens com as quantidades mínimas; True nos itens abaixo do mínimo de algum produto
+def merge_invalid(line_items: pd.DataFrame, products_minimum: pd.DataFrame) -> np.ndarray:
+    products_cart = line_items[['product_id', 'quantity']].assign(row=np.arange(len(line_items)))
     products_check = pd.merge(products_cart, products_minimum, on='product_id', how='inner')
+    invalid = np.zeros(len(line_items), dtype=bool)
+    invalid[products_check.loc[products_check['quantity'] < products_check['minimumOrderQuantity'], 'row'].to_numpy()] = True
+    return invalid
+
+# Indica os itens com quantidade abaixo do mínimo do produto: busca direta no índice denso (gather) e
+# comparação vetorizada; apenas itens com ids fora do índice passam pelo merge
+def invalid_line_items(line_items: pd.DataFrame, minimum_index: dict) -> np.ndarray:
+    minimums = minimum_index['minimums']
+    if minimums is None or not (is_number(line_items['product_id']) and is_number(line_items['quantity'])):
+        return merge_invalid(line_items, minimum_index['products'])
+    ids, dense = integer_ids(line_items['product_id'])
+    dense &= ids < len(minimums)
+    quantity = line_items['quantity'].to_numpy(dtype='float64', na_value=np.nan)
+    invalid = np.zeros(len(line_items), dtype=bool)
+    invalid[dense] = quantity[dense] < minimums[ids[dense]]    # NaN (sem produto ou sem mínimo) nunca invalida
+    others = ~dense
+    if others.any() and not minimum_index['others'].empty:
+        invalid[others] = merge_invalid(line_items[others], minimum_index['others'])
+    return invalid
+
+# Função para remover pedidos que não atendem à quantidade mínima
+@instrument
+def remove_invalid_orders(data_carts: pd.DataFrame, data_products: pd.DataFrame | None = None,
+                          minimum_index: dict | None = None) -> pd.DataFrame:
+    logging.info("Removendo pedidos com quantidade de produtos abaixo do mínimo")
+    if minimum_index is None:
+        if data_products is None:
+            data_products = extract_collection('products', PRODUCTS_FIELDS, use_cache=True)  # Extrai dados de produtos
+        minimum_index = build_minimum_index(data_products)
+    before = len(data_carts)
 
-    # Identifica carrinhos inválidos
-    invalid_carts = products_check.loc[
-        products_check['quantity'] < products_check['minimumOrderQuantity'],
-        'cart_index'
-    ].unique()
+    # Itens dos carrinhos em colunas (uma linha por item, com o índice do carrinho)
+    line_items = flatten_line_items(data_carts)
 
-    # Remove carrinhos inválidos
-    data_carts = data_carts.drop(index=invalid_carts)
+    # Carrinho inválido: algum de seus itens abaixo da quantidade mínima
+    invalid = invalid_line_items(line_items, minimum_index)
+    data_carts = data_carts[~data_carts.index.isin(line_items['cart_index'].to_numpy()[invalid])]
     removed = before - len(data_carts)
     if removed > 0:
         logging.warning(f"{removed} carrinhos removidos por não atenderem quantidade mínima")
     logging.info(f"Carrinhos válidos restantes: {len(data_carts)}")
     return data_carts
 
+# Etapas de limpeza de carts; todas avaliam cada carrinho isoladamente
+def clean_carts_rows(data_carts: pd.DataFrame, minimum_index: dict) -> pd.DataFrame:
+    data_carts = remove_invalid_orders(data_carts, minimum_index=minimum_index)
+    data_carts = drop_missing_values(data_carts)
+    data_carts = drop_inconsistent_values(data_carts)
+    data_carts = transform_transaction_date(data_carts)
+    return data_carts
+
+# Aplica a sequência de limpeza e transformação a um DataFrame (completo ou lote) de carts.
+# O índice de quantidades mínimas pode ser montado uma vez (build_minimum_index) e reutilizado entre lotes
+def clean_carts(data_carts: pd.DataFrame, data_products: pd.DataFrame | None = None,
+                minimum_index: dict | None = None) -> pd.DataFrame:
+    if minimum_index is None:
+        if data_products is None:
+            data_products = extract_collection('products', PRODUCTS_FIELDS, use_cache=True)  # Extraído aqui, e não em cada lote paralelo
+        minimum_index = build_minimum_index(data_products)
+    # Em lotes paralelos se ETL_TRANSFORM_WORKERS > 1 (ver parallel.run_stages)
+    data_carts = run_stages(data_carts, [(functools.partial(clean_carts_rows, minimum_index=minimum_index), 'chunk')])
+    data_carts = apply_schema(data_carts, CARTS_SCHEMA)  # Inteiros compactos
+    return data_carts
+
+# Mensagens das etapas em pandas para cada motivo de rejeição avaliado no MongoDB (ver extract.CART_REJECTIONS)
+REJECTION_MESSAGES = {
+    'minimum_quantity': "carrinhos removidos por não atenderem quantidade mínima",
+    'missing_values': "registros removidos por valores ausentes",
+    'inconsistent_values': "registros removidos por inconsistências",
+}
+
+# Validação de carts feita no MongoDB (ETL_CARTS_PUSHDOWN), em vez das etapas em pandas
+def use_pushdown(pushdown: bool | None = None) -> bool:
+    if pushdown is None:
+        pushdown = os.getenv("ETL_CARTS_PUSHDOWN", "false").lower() == "true"
+    return pushdown
+
+@instrument
+def clean_line_items(line_items: pd.DataFrame, rejected: dict) -> pd.DataFrame:
+    """
+    Conclui a limpeza dos itens de carts validados no MongoDB: registra as
+    rejeições com as mesmas mensagens das etapas em pandas e converte
+    transaction_date uma vez por carrinho (transform_transaction_date),
+    removendo os itens dos carrinhos com data inválida.
+    """
+    for reason, message in REJECTION_MESSAGES.items():
+        if rejected.get(reason, 0) > 0:
+            logging.warning(f"{rejected[reason]} {message}")
+    if line_items.empty:
+        return line_items
+
+    # Itens de um mesmo carrinho compartilham a data: converte apenas a primeira linha de cada carrinho
+    cart_codes, _ = pd.factorize(line_items['_id'])
+    carts = line_items.loc[~line_items['_id'].duplicated(), ['_id', 'transaction_date']].reset_index(drop=True)
+    carts = transform_transaction_date(carts)
+    dates = np.full(cart_codes.max() + 1, None, dtype=object)
+    dates[carts.index.to_numpy()] = carts['transaction_date'].to_numpy(dtype=object)
+
+    line_items = line_items.copy(deep=False)
+    line_items['transaction_date'] = dates[cart_codes]
+    line_items = line_items[pd.notna(line_items['transaction_date'])]
+    return apply_schema(line_items, CARTS_SCHEMA)
+
 # Função principal do ETL de carts
-def run_etl_carts() -> pd.DataFrame:
+def run_etl_carts(query: dict | None = None, data_products: pd.DataFrame | None = None,
+                  pushdown: bool | None = None) -> pd.DataFrame:
     logging.info("Iniciando ETL de carts")
     try:
-        data_carts = extract_collection('carts')  # Extração da coleção MongoDB
+        if use_pushdown(pushdown):
+            # Itens achatados e validados no MongoDB (uma linha por item, ver extract.build_carts_pipeline)
+            line_items, rejected = extract_cart_line_items(CARTS_FIELDS, query)
+            data_carts = clean_line_items(line_items, rejected)
+            logging.info(f"ETL de carts (pushdown) concluído com {len(data_carts)} itens válidos")
+            return data_carts
+
+        data_carts = drop_wide_columns(extract_collection('carts', CARTS_FIELDS, query))  # Extração da coleção MongoDB
         logging.info(f"{len(data_carts)} registros extraídos da coleção 'carts'")
+        if data_carts.empty:
+            return data_carts  # Nada a transformar (ex.: nenhum documento novo na carga incremental)
 
         # Limpeza e transformação em sequência
-        data_carts = remove_invalid_orders(data_carts)
-        data_carts = drop_missing_values(data_carts)
-        data_carts = drop_inconsistent_values(data_carts)
-        data_carts = transform_transaction_date(data_carts)
+        data_carts = clean_carts(data_carts, data_products)
 
         logging.info(f"ETL de carts concluído com {len(data_carts)} registros válidos")
         return data_carts
     except Exception as e:
         logging.error(f"Falha no ETL de carts: {e}")
         raise
+
+# ETL de carts em modo streaming: devolve lotes de até chunk_size carrinhos já transformados
+def iter_etl_carts(chunk_size: int | None = None, query: dict | None = None,
+                   data_products: pd.DataFrame | None = None, pushdown: bool | None = None):
+    logging.info("Iniciando ETL de carts em modo streaming")
+    try:
+        if use_pushdown(pushdown):
+            # Lotes de itens já validados no MongoDB; products não precisa ser extraído
+            total = 0
+            for chunk_number, (line_items, rejected) in enumerate(iter_cart_line_items(CARTS_FIELDS, query, chunk_size), start=1):
+                logging.info(f"Lote {chunk_number} de carts (pushdown): {len(line_items)} itens extraídos")
+                data_carts = clean_line_items(line_items, rejected)
+                total += len(data_carts)
+                yield data_carts
+            logging.info(f"ETL de carts em streaming (pushdown) concluído com {total} itens válidos")
+            return
+
+        # Produtos são extraídos uma única vez (completos, mesmo em carga incremental)
+        # e reutilizados na validação de todos os lotes
+        if data_products is None:
+            data_products = extract_collection('products', PRODUCTS_FIELDS, use_cache=True)
+        minimum_index = build_minimum_index(data_products)
+        total = 0
+        # Com partições de _id (MONGO_EXTRACT_PARTITIONS), cada uma lê no máximo 2 lotes à frente do consumo
+        lots = iter_collection('carts', CARTS_FIELDS, query, chunk_size, prefetch=2)
+        for chunk_number, data_carts in enumerate(lots, start=1):
+            logging.info(f"Lote {chunk_number} de carts: {len(data_carts)} registros extraídos")
+            data_carts = clean_carts(drop_wide_columns(data_carts), minimum_index=minimum_index)
+            total += len(data_carts)
+            yield data_carts
+        logging.info(f"ETL de carts em streaming concluído com {total} registros válidos")
+    except Exception as e:
+        logging.error(f"Falha no ETL de carts em streaming: {e}")
+        raise
@@ -2,6 +2,9 @@ import logging
 import pandas as pd
 # Importa função de extração da coleção MongoDB
 from ..extract.extract import extract_collection
+from ..metrics import instrument
+from .schema import PRODUCTS_SCHEMA, apply_schema, drop_wide_columns
+from .parallel import run_stages
 
 # Configuração global de logs para o ETL de products
 logging.basicConfig(
@@ -9,7 +12,14 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Campos de products usados pelo ETL (projeção aplicada no MongoDB)
+PRODUCTS_FIELDS = ['id', 'title', 'description', 'category', 'price', 'discountPercentage',
+                   'rating', 'stock', 'brand', 'sku', 'weight', 'warrantyInformation',
+                   'shippingInformation', 'availabilityStatus', 'returnPolicy',
+                   'minimumOrderQuantity', 'thumbnail']
+
 # Remove registros com valores ausentes obrigatórios
+@instrument
 def drop_missing_values(data_products: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros com valores ausentes (title, price)")
     before = len(data_products)
@@ -22,6 +32,7 @@ def drop_missing_values(data_products: pd.DataFrame) -> pd.DataFrame:
     return data_products
 
 # Remove registros duplicados com base em campos críticos
+@instrument
 def drop_duplicates_values(data_products: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros duplicados (title, sku)")
     before = len(data_products)
@@ -35,6 +46,7 @@ def drop_duplicates_values(data_products: pd.DataFrame) -> pd.DataFrame:
     return data_products
 
 # Remove registros com campos vazios ou apenas espaços
+@instrument
 def drop_spaces(data_products: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros com campos vazios ou apenas espaços")
     before = len(data_products)
@@ -52,6 +64,7 @@ def drop_spaces(data_products: pd.DataFrame) -> pd.DataFrame:
     return data_products
 
 # Remove registros com valores inconsistentes (negativos ou fora de faixa)
+@instrument
 def drop_inconsistent_values(data_products: pd.DataFrame) -> pd.DataFrame:
     logging.info("Removendo registros com valores inconsistentes")
     before = len(data_products)
@@ -70,19 +83,32 @@ def drop_inconsistent_values(data_products: pd.DataFrame) -> pd.DataFrame:
     logging.info(f"Registros restantes: {len(data_products)}")
     return data_products
 
+# Sequência de limpeza de products: (etapa, escopo). Etapas 'chunk' avaliam cada registro isoladamente
+# e podem rodar em lotes paralelos; a remoção de duplicados compara todos os registros (ver parallel.run_stages)
+PRODUCTS_STAGES = [
+    (drop_missing_values, 'chunk'),
+    (drop_duplicates_values, 'global'),
+    (drop_spaces, 'chunk'),
+    (drop_inconsistent_values, 'chunk'),
+]
+
 # Função principal do ETL de products
-def run_etl_products() -> pd.DataFrame:
+def run_etl_products(query: dict | None = None, raw_products: pd.DataFrame | None = None) -> pd.DataFrame:
     logging.info("Iniciando ETL de products")
     try:
-        # Extração dos dados da coleção MongoDB 'products'
-        data_products = extract_collection('products')
+        # Extração dos dados da coleção MongoDB 'products' (ou reuso de uma extração já feita)
+        if raw_products is not None:
+            data_products = raw_products
+        else:
+            data_products = extract_collection('products', PRODUCTS_FIELDS, query, use_cache=True)
+        data_products = drop_wide_columns(data_products)
         logging.info(f"{len(data_products)} registros extraídos da coleção 'products'")
+        if data_products.empty:
+            return data_products  # Nada a transformar (ex.: nenhum documento novo na carga incremental)
 
-        # Sequência de limpeza e transformação
-        data_products = drop_missing_values(data_products)
-        data_products = drop_duplicates_values(data_products)
-        data_products = drop_spaces(data_products)
-        data_products = drop_inconsistent_values(data_products)
+        # Sequência de limpeza e transformação (em lotes paralelos se ETL_TRANSFORM_WORKERS > 1)
+        data_products = run_stages(data_products, PRODUCTS_STAGES)
+        data_products = apply_schema(data_products, PRODUCTS_SCHEMA)  # Categóricas e inteiros compactos
 
         logging.info(f"ETL de products concluído com {len(data_products)} registros válidos")
         return data_products
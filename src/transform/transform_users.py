@@ -1,7 +1,13 @@
 import logging
+import numpy as np
 import pandas as pd
 # Importa função de extração da coleção MongoDB
 from ..extract.extract import extract_collection
+from ..metrics import instrument
+from .rules import apply_rules
+from .validators import NAME_PATTERN, EMAIL_PATTERN, matches
+from .schema import USERS_SCHEMA, apply_schema, drop_wide_columns
+from .parallel import run_stages, use_parallel
 
 # Configuração global de logs para o ETL de users
 logging.basicConfig(
@@ -9,170 +15,210 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Campos de users usados pelo ETL (projeção aplicada no MongoDB)
+USERS_FIELDS = ['id', 'firstName', 'lastName', 'maidenName', 'age', 'gender', 'email',
+                'phone', 'username', 'password', 'birthDate', 'bloodGroup', 'height',
+                'weight', 'eyeColor', 'ip', 'macAddress', 'university', 'role', 'cpf', 'cnpj',
+                'address.city', 'address.state', 'address.country']
+
+# Campos opcionais padronizados como texto sem espaços nas bordas
+OPTIONAL_FIELDS = ['image', 'bloodGroup', 'eyeColor', 'ip', 'macAddress',
+                   'university', 'userAgent', 'role', 'cnpj', 'city', 'state', 'country']
+
+# Regra de nome obrigatório: remove vazios, com menos de 2 caracteres ou com caracteres inválidos
+def name_rule(column: str) -> dict:
+    return {
+        "description": f"Limpando {column}",
+        "reason": f"{column} inválido",
+        "keep": lambda col: ~((col(column, 'strip') == '') |
+                              (col(column, 'len') < 2) |
+                              (~matches(col(column), NAME_PATTERN))),
+        "normalize": {column: lambda col: col(column, 'strip_capitalize')},
+    }
+
+# Regras de validação e padronização de users, na ordem em que são avaliadas (ver rules.apply_rules)
+MISSING_VALUES_RULE = {
+    "description": "Removendo registros com valores ausentes obrigatórios",
+    "reason": "valores ausentes",
+    "keep": lambda col: np.logical_and.reduce([col(c).notna() for c in ['firstName', 'lastName', 'username', 'email',
+                                                                         'password', 'city', 'state', 'country']]),
+}
+DUPLICATES_RULE = {
+    "description": "Removendo registros duplicados (email, username, cpf, cnpj)",
+    "reason": "duplicidade",
+    "unique": ['email', 'username', 'cpf', 'cnpj'],
+}
+FIRST_NAME_RULE = name_rule('firstName')
+LAST_NAME_RULE = name_rule('lastName')
+MAIDEN_NAME_RULE = {
+    "description": "Limpando maidenName",
+    "reason": "maidenName inválido",
+    # Remove apenas registros com caracteres inválidos (vazio é permitido)
+    "keep": lambda col: ~((~matches(col('maidenName'), NAME_PATTERN)) & (col('maidenName') != '')),
+    "normalize": {'maidenName': lambda col: col('maidenName', 'strip_capitalize')},
+}
+INCONSISTENT_VALUES_RULE = {
+    "description": "Removendo registros com idade, altura ou peso inconsistentes",
+    "reason": "valores inconsistentes",
+    "keep": lambda col: (col('age') >= 0) & (col('age') <= 120) & (col('height') >= 0) & (col('weight') >= 0),
+}
+GENDER_RULE = {
+    "description": "Padronizando campo gender",
+    "normalize": {'gender': lambda col: col('gender', 'strip_lower').replace({'m': 'male', 'f': 'female', 'male': 'male', 'female': 'female'})},
+}
+PHONE_RULE = {
+    "description": "Limpando phone numbers",
+    "reason": "telefone inválido",
+    "keep": lambda col: col('phone', 'strip').str.startswith('+', na=False),  # Garante padrão internacional
+    "normalize": {'phone': lambda col: col('phone', 'strip')},
+}
+USERNAME_RULE = {
+    "description": "Limpando username",
+    "normalize": {'username': lambda col: col('username', 'strip_lower')},
+}
+OPTIONAL_FIELDS_RULE = {
+    "description": "Limpando campos opcionais do usuário",
+    "normalize": {c: (lambda col, c=c: col(c, 'as_str_strip')) for c in OPTIONAL_FIELDS},
+}
+EMAIL_RULE = {
+    "description": "Limpando emails",
+    "reason": "email inválido",
+    "keep": lambda col: matches(col('email', 'strip_lower'), EMAIL_PATTERN),
+    "normalize": {'email': lambda col: col('email', 'strip_lower')},
+}
+BIRTHDATE_RULE = {
+    "description": "Convertendo birthDate para datetime",
+    "reason": "birthDate inválido",
+    "keep": lambda col: col('birthDate', 'ymd_date').notna(),
+    "normalize": {'birthDate': lambda col: col('birthDate', 'ymd_date')},
+}
+
+USERS_RULES = [
+    MISSING_VALUES_RULE,
+    DUPLICATES_RULE,
+    FIRST_NAME_RULE,
+    LAST_NAME_RULE,
+    MAIDEN_NAME_RULE,
+    INCONSISTENT_VALUES_RULE,
+    GENDER_RULE,
+    PHONE_RULE,
+    USERNAME_RULE,
+    OPTIONAL_FIELDS_RULE,
+    EMAIL_RULE,
+    BIRTHDATE_RULE,
+]
+
+# Regras avaliadas registro a registro após a remoção de duplicados
+ROW_RULES_AFTER_DUPLICATES = USERS_RULES[USERS_RULES.index(DUPLICATES_RULE) + 1:]
+
+# Aplica todas as regras de users em uma única passada (uma cópia do DataFrame)
+@instrument
+def clean_users(data_users: pd.DataFrame) -> pd.DataFrame:
+    return apply_rules(data_users, USERS_RULES)
+
+# Aplica, em uma única passada, as regras posteriores à remoção de duplicados
+@instrument
+def clean_users_rows(data_users: pd.DataFrame) -> pd.DataFrame:
+    return apply_rules(data_users, ROW_RULES_AFTER_DUPLICATES)
+
 # Remove registros com valores obrigatórios ausentes
+@instrument
 def drop_missing_values(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Removendo registros com valores ausentes obrigatórios")
-    before = len(data_users)
-    data_users = data_users.dropna(subset=['firstName', 'lastName', 'username', 'email', 'password', 'city', 'state', 'country'])
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por valores ausentes")
-    logging.info(f"Registros restantes: {len(data_users)}")
-    return data_users
+    return apply_rules(data_users, [MISSING_VALUES_RULE])
 
 # Remove duplicados com base em campos críticos
+@instrument
 def drop_duplicates_values(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Removendo registros duplicados (email, username, cpf, cnpj)")
-    before = len(data_users)
-    unique_fields = ['email', 'username', 'cpf', 'cnpj']
-    data_users = data_users.drop_duplicates(subset=unique_fields, keep='first')
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros duplicados removidos")
-    logging.info(f"Registros restantes: {len(data_users)}")
-    return data_users
+    return apply_rules(data_users, [DUPLICATES_RULE])
 
 # Limpa e padroniza firstName
+@instrument
 def clean_first_names(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando firstName")
-    before = len(data_users)
-    # Remove nomes vazios, com menos de 2 caracteres ou com caracteres inválidos
-    data_users = data_users[~((data_users['firstName'].str.strip() == '') | 
-                              (data_users['firstName'].str.len() < 2) | 
-                              (~data_users['firstName'].str.match(r'^[A-Za-zÀ-ÿ\s]+$')))]
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por firstName inválido")
-    # Padroniza capitalização e remove espaços
-    data_users['firstName'] = data_users['firstName'].str.strip().str.capitalize()
-    return data_users
+    return apply_rules(data_users, [FIRST_NAME_RULE])
 
 # Limpa e padroniza lastName
+@instrument
 def clean_last_names(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando lastName")
-    before = len(data_users)
-    data_users = data_users[~((data_users['lastName'].str.strip() == '') | 
-                              (data_users['lastName'].str.len() < 2) | 
-                              (~data_users['lastName'].str.match(r'^[A-Za-zÀ-ÿ\s]+$')))]
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por lastName inválido")
-    data_users['lastName'] = data_users['lastName'].str.strip().str.capitalize()
-    return data_users
+    return apply_rules(data_users, [LAST_NAME_RULE])
 
 # Limpa maidenName (nome de solteira)
+@instrument
 def clean_maiden_names(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando maidenName")
-    before = len(data_users)
-    # Remove apenas registros com caracteres inválidos
-    data_users = data_users[~((~data_users['maidenName'].str.match(r'^[A-Za-zÀ-ÿ\s]+$')) & (data_users['maidenName'] != ''))]
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por maidenName inválido")
-    data_users['maidenName'] = data_users['maidenName'].str.strip().str.capitalize()
-    return data_users
+    return apply_rules(data_users, [MAIDEN_NAME_RULE])
 
 # Remove registros com valores inconsistentes de idade, altura ou peso
+@instrument
 def drop_inconsistent_values(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Removendo registros com idade, altura ou peso inconsistentes")
-    before = len(data_users)
-    data_users = data_users[(data_users['age'] >= 0) & (data_users['age'] <= 120)]
-    data_users = data_users[(data_users['height'] >= 0) & (data_users['weight'] >= 0)]
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por valores inconsistentes")
-    logging.info(f"Registros restantes: {len(data_users)}")
-    return data_users
+    return apply_rules(data_users, [INCONSISTENT_VALUES_RULE])
 
 # Padroniza campo gender
+@instrument
 def parse_gender(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Padronizando campo gender")
-    data_users['gender'] = data_users['gender'].str.strip().str.lower()
-    data_users['gender'] = data_users['gender'].replace({'m': 'male', 'f': 'female', 'male': 'male', 'female': 'female'})
-    return data_users
+    return apply_rules(data_users, [GENDER_RULE])
 
 # Limpa números de telefone
+@instrument
 def clean_phone_numbers(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando phone numbers")
-    before = len(data_users)
-    data_users['phone'] = data_users['phone'].str.strip()
-    data_users = data_users[data_users['phone'].str.startswith('+')]  # Garante padrão internacional
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por telefone inválido")
-    return data_users
+    return apply_rules(data_users, [PHONE_RULE])
 
 # Limpa username
+@instrument
 def clean_username(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando username")
-    data_users['username'] = data_users['username'].str.strip().str.lower()
-    return data_users
+    return apply_rules(data_users, [USERNAME_RULE])
 
 # Limpa campos opcionais do usuário
+@instrument
 def clean_user_fields(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando campos opcionais do usuário")
-    columns_to_strip = ['image', 'bloodGroup', 'eyeColor', 'ip', 'macAddress',
-                        'university', 'userAgent', 'role', 'cnpj', 'city', 'state', 'country']
-    for col in columns_to_strip:
-        if col in data_users.columns:
-            data_users[col] = data_users[col].astype(str).str.strip()
-    return data_users
+    return apply_rules(data_users, [OPTIONAL_FIELDS_RULE])
 
 # Valida e padroniza emails
+@instrument
 def clean_user_email(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Limpando emails")
-    before = len(data_users)
-    data_users['email'] = data_users['email'].str.strip().str.lower()
-    email_pattern = r'^[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}$'
-    data_users = data_users[data_users['email'].str.match(email_pattern)]
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por email inválido")
-    return data_users
+    return apply_rules(data_users, [EMAIL_RULE])
 
 # Converte birthDate para datetime e remove inválidos
+@instrument
 def clean_user_birthdate(data_users: pd.DataFrame) -> pd.DataFrame:
-    logging.info("Convertendo birthDate para datetime")
-    data_users['birthDate'] = data_users['birthDate'].str.strip()
-    data_users['birthDate'] = pd.to_datetime(data_users['birthDate'], format='%Y-%m-%d', errors='coerce')
-    before = len(data_users)
-    data_users = data_users.dropna(subset=['birthDate'])
-    removed = before - len(data_users)
-    if removed > 0:
-        logging.warning(f"{removed} registros removidos por birthDate inválido")
-    return data_users
+    return apply_rules(data_users, [BIRTHDATE_RULE])
 
 # Explode a coluna address em city, state e country
+@instrument
 def explode_address(data_users: pd.DataFrame) -> pd.DataFrame:
     logging.info("Explodindo coluna address para city, state, country")
     address = pd.json_normalize(data_users['address'])
+    address.index = data_users.index          # Alinha com os rótulos do DataFrame (ex.: lotes paralelos)
     cols = ['city', 'state', 'country']
     for col in cols:
         data_users[col] = address.get(col)
     return data_users
 
+# Etapas do ETL de users em lotes paralelos (ver parallel.run_stages). Os duplicados são comparados entre
+# todos os lotes, sobre os registros com valores obrigatórios; as regras que os antecedem não normalizam
+# valores, então o resultado é o mesmo de clean_users
+USERS_STAGES = [
+    (explode_address, 'chunk'),
+    (drop_missing_values, 'chunk'),
+    (drop_duplicates_values, 'global'),
+    (clean_users_rows, 'chunk'),
+]
+
 # Função principal do ETL de users
-def run_etl_users() -> pd.DataFrame:
+def run_etl_users(query: dict | None = None) -> pd.DataFrame:
     logging.info("Iniciando ETL de users")
     try:
         # Extração da coleção MongoDB 'users'
-        data_users = extract_collection('users')
+        data_users = drop_wide_columns(extract_collection('users', USERS_FIELDS, query))
         logging.info(f"{len(data_users)} registros extraídos da coleção 'users'")
-
-        # Sequência completa de limpeza e transformação
-        data_users = explode_address(data_users)
-        data_users = drop_missing_values(data_users)
-        data_users = drop_duplicates_values(data_users)
-        data_users = clean_first_names(data_users)
-        data_users = clean_last_names(data_users)
-        data_users = clean_maiden_names(data_users)
-        data_users = drop_inconsistent_values(data_users)
-        data_users = parse_gender(data_users)
-        data_users = clean_phone_numbers(data_users)
-        data_users = clean_username(data_users)
-        data_users = clean_user_fields(data_users)
-        data_users = clean_user_email(data_users)
-        data_users = clean_user_birthdate(data_users)
+        if data_users.empty:
+            return data_users  # Nada a transformar (ex.: nenhum documento novo na carga incremental)
+
+        # Endereço expandido e, em seguida, todas as regras de limpeza em uma única passada
+        if use_parallel(len(data_users)):
+            data_users = run_stages(data_users, USERS_STAGES)  # Lotes em processos (ETL_TRANSFORM_WORKERS)
+        else:
+            data_users = explode_address(data_users)
+            data_users = clean_users(data_users)
+        data_users = apply_schema(data_users, USERS_SCHEMA)  # Categóricas e inteiros compactos
 
         logging.info(f"ETL de users concluído com {len(data_users)} registros válidos")
         return data_users
@@ -0,0 +1,97 @@
+import functools
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Padrões de validação compilados uma única vez (usados em todas as chamadas e no caminho de fallback)
+NAME_PATTERN = re.compile(r'^[A-Za-zÀ-ÿ\s]+$')                           # Letras, acentos e espaços
+EMAIL_PATTERN = re.compile(r'^[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}$')
+
+# Caracteres aceitos por \s no re do Python (equivale a str.isspace()); no RE2, \s é apenas [\t\n\f\r ]
+PYTHON_SPACES = (r'\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\x{1680}\x{2000}-\x{200a}'
+                 r'\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}')
+
+# Classes cujo significado muda entre o re do Python (Unicode) e o RE2 e que não são traduzidas
+UNSUPPORTED_ESCAPES = set('dDwWbBSAZ')
+
+@functools.lru_cache(maxsize=None)
+def re2_pattern(pattern: str) -> str | None:
+    """
+    Traduz um padrão do re do Python para o RE2 (pyarrow) com o mesmo
+    resultado em `match`: \\s vira a lista de espaços do Python. O $ só é
+    aceito no fim do padrão; lá o re também aceita a posição antes de um
+    \\n final, por isso textos terminados em \\n são reavaliados com o re
+    (ver matches). Devolve None se o padrão usar recursos que não são
+    traduzidos (o re do Python é usado nesse caso).
+    """
+    translated, in_class, class_start, i = [], False, 0, 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            escape = pattern[i + 1]
+            if escape in UNSUPPORTED_ESCAPES:
+                return None
+            if escape == 's':
+                translated.append(PYTHON_SPACES if in_class else f'[{PYTHON_SPACES}]')
+            else:
+                translated.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if char == '[' and not in_class:
+            in_class, class_start = True, i + 1 + pattern.startswith('^', i + 1)
+        elif char == ']' and in_class and i > class_start:   # ] logo após [ ou [^ é literal
+            in_class = False
+        elif char == '$' and not in_class and i != len(pattern) - 1:
+            return None                        # $ no meio do padrão (ex.: alternativas) não é traduzido
+        elif char == '(' and pattern.startswith('(?', i):
+            return None                        # Grupos especiais/flags inline
+        translated.append(char)
+        i += 1
+    if not translated or translated[0] != '^':
+        translated.insert(0, '^')              # match ancora no início do texto
+    return ''.join(translated)
+
+# Converte a coluna para um array de texto do pyarrow; devolve None se houver valores que não são texto
+def arrow_strings(values: pd.Series) -> pa.ChunkedArray | pa.Array | None:
+    if isinstance(values.dtype, pd.StringDtype) and values.dtype.storage == "pyarrow":
+        return values.array._pa_array
+    if isinstance(values.dtype, pd.ArrowDtype) and pa.types.is_string(values.dtype.pyarrow_dtype):
+        return values.array._pa_array
+    if values.dtype == object:
+        try:
+            return pa.array(values.to_numpy(), type=pa.string(), from_pandas=True)  # Números, listas etc. falham
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+    return None
+
+# Avaliação registro a registro com o re do Python (valores que não são texto são inválidos)
+def python_matches(values, pattern: re.Pattern) -> np.ndarray:
+    return np.fromiter((isinstance(v, str) and pattern.match(v) is not None for v in values),
+                       dtype=bool, count=len(values))
+
+# Converte uma máscara do pyarrow em array booleano (nulos contam como False)
+def arrow_mask(mask) -> np.ndarray:
+    return np.asarray(pc.fill_null(mask, False).to_numpy(zero_copy_only=False), dtype=bool)
+
+def matches(values: pd.Series, pattern: re.Pattern) -> np.ndarray:
+    """
+    Equivale a `values.str.match(pattern, na=False)` avaliado com o re do
+    Python, devolvendo um array booleano. Colunas de texto (string[pyarrow]
+    ou object só com textos) são avaliadas pelo kernel de regex vetorizado
+    do pyarrow com o padrão traduzido por re2_pattern (textos terminados
+    em \\n, raros, são reavaliados com o re); demais colunas e padrões com
+    flags ou não traduzíveis usam o padrão compilado do re.
+    """
+    translated = re2_pattern(pattern.pattern) if pattern.flags & ~re.UNICODE == 0 else None
+    strings = arrow_strings(values) if translated is not None else None
+    if strings is None:
+        return python_matches(values.to_numpy(dtype=object), pattern)
+
+    result = arrow_mask(pc.match_substring_regex(strings, translated))
+    if translated.endswith('$'):
+        rows = np.flatnonzero(arrow_mask(pc.ends_with(strings, '\n')))
+        if len(rows) > 0:
+            result[rows] = python_matches(strings.take(rows).to_pylist(), pattern)
+    return result